@@ -0,0 +1,121 @@
+from time import monotonic
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from unicef_rest_export.utils import get_export_attr
+
+# limits by renderer format, "default" applying to the formats not listed,
+# e.g. {"default": {"rows": 50000}, "pdf": {"rows": 2000, "seconds": 60}}
+EXPORT_BUDGETS = getattr(settings, "EXPORT_BUDGETS", {})
+
+
+class ExportTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Export is too large."
+    default_code = "export_too_large"
+
+
+class ExportTooSlow(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "Export is taking too long."
+    default_code = "export_too_slow"
+
+
+class ExportBudget:
+    """Row, output size and time limits of an export, raising
+    ExportTooLarge or ExportTooSlow as soon as one of them is over
+    """
+
+    enabled = True
+    check_every = 1000
+
+    def __init__(self, format, rows=None, bytes=None, seconds=None, alternatives=()):
+        self.format = format
+        self.rows = rows
+        self.bytes = bytes
+        self.seconds = seconds
+        self.alternatives = alternatives
+        self.deadline = monotonic() + seconds if seconds else None
+
+    def get_advice(self):
+        if self.alternatives:
+            return "Use a filter to narrow it down, or a streaming format ({}).".format(", ".join(self.alternatives))
+        return "Use a filter to narrow it down."
+
+    def check_rows(self, count):
+        if self.rows is not None and count > self.rows:
+            raise ExportTooLarge(
+                "Export has more than {} rows, the limit for {}. {}".format(self.rows, self.format, self.get_advice())
+            )
+
+    def check_size(self, size):
+        if self.bytes is not None and size > self.bytes:
+            raise ExportTooLarge(
+                "Export is over {} bytes, the limit for {}. {}".format(self.bytes, self.format, self.get_advice())
+            )
+
+    def check_time(self):
+        if self.deadline is not None and monotonic() > self.deadline:
+            raise ExportTooSlow(
+                "Export took over {} seconds, the limit for {}. {}".format(self.seconds, self.format, self.get_advice())
+            )
+
+    def iter_rows(self, rows):
+        """Check the rows and time every check_every rows"""
+        for count, row in enumerate(rows, 1):
+            if not count % self.check_every:
+                self.check_rows(count)
+                self.check_time()
+            yield row
+
+    def wrap_output(self, output):
+        return BudgetOutput(output, self)
+
+
+class BudgetOutput:
+    """Renderer output checking the size and time budget on every write"""
+
+    def __init__(self, output, budget):
+        self._output = output
+        self._budget = budget
+        self._size = 0
+
+    def write(self, content):
+        self._size += len(content)
+        self._budget.check_size(self._size)
+        self._budget.check_time()
+        return self._output.write(content)
+
+    def __getattr__(self, name):
+        return getattr(self._output, name)
+
+
+class NullBudget:
+    """Stands in for ExportBudget when there are no limits"""
+
+    enabled = False
+
+    def check_rows(self, count):
+        pass
+
+    def check_size(self, size):
+        pass
+
+    def check_time(self):
+        pass
+
+    def iter_rows(self, rows):
+        return rows
+
+    def wrap_output(self, output):
+        return output
+
+
+NULL_BUDGET = NullBudget()
+
+
+def get_export_budget(context):
+    """Budget of the export the renderer context belongs to"""
+    return get_export_attr(context, "export_budget", NULL_BUDGET)
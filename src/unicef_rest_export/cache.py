@@ -0,0 +1,76 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Count, Max
+
+EXPORT_CACHE_TIMEOUT = getattr(settings, "EXPORT_CACHE_TIMEOUT", None)
+EXPORT_CACHE_ALIAS = getattr(settings, "EXPORT_CACHE_ALIAS", "default")
+EXPORT_CACHE_MAX_ENTRY_SIZE = getattr(settings, "EXPORT_CACHE_MAX_ENTRY_SIZE", 5 * 1024 * 1024)
+EXPORT_CACHE_MAX_SIZE = getattr(settings, "EXPORT_CACHE_MAX_SIZE", 100 * 1024 * 1024)
+
+
+def get_fingerprint(queryset, modified_field=None):
+    """Cheap summary of the queryset, that changes when rows are
+    added, removed or, with a modified field, updated
+    """
+    aggregates = {"count": Count("pk"), "max_pk": Max("pk")}
+    if modified_field:
+        aggregates["modified"] = Max(modified_field)
+    return queryset.order_by().aggregate(**aggregates)
+
+
+def get_modified_field(model, names=("modified",)):
+    for name in names:
+        try:
+            model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        return name
+    return None
+
+
+def get_etag(content):
+    """ETag of a cached export, from its content so it goes with the entry"""
+    return '"{}"'.format(hashlib.sha1(content).hexdigest())
+
+
+def get_cache_key(*parts):
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+    return "unicef_rest_export:{}".format(digest)
+
+
+class ExportCache:
+    """Rendered exports kept in Django's cache framework.
+    Entries over max_entry_size are not cached, and the oldest entries are
+    evicted once their total size goes over max_size, using an index of
+    keys and sizes that is itself kept in the cache.
+    """
+
+    index_key = "unicef_rest_export:index"
+
+    def __init__(self, alias=None, max_entry_size=None, max_size=None):
+        self.cache = caches[alias or EXPORT_CACHE_ALIAS]
+        self.max_entry_size = max_entry_size or EXPORT_CACHE_MAX_ENTRY_SIZE
+        self.max_size = max_size or EXPORT_CACHE_MAX_SIZE
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, content_type, content, timeout):
+        size = len(content)
+        if size > self.max_entry_size:
+            return False
+
+        index = [entry for entry in self.cache.get(self.index_key, []) if entry[0] != key]
+        index.append((key, size))
+        total = sum(entry_size for _, entry_size in index)
+        while total > self.max_size:
+            evicted, evicted_size = index.pop(0)
+            self.cache.delete(evicted)
+            total -= evicted_size
+
+        self.cache.set(key, (content_type, content), timeout)
+        self.cache.set(self.index_key, index, None)
+        return True
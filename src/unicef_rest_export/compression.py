@@ -0,0 +1,95 @@
+import zlib
+from io import BytesIO
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+from unicef_rest_export.utils import get_export_attr
+
+EXPORT_COMPRESSION = getattr(settings, "EXPORT_COMPRESSION", True)
+
+# content encodings in order of preference,
+# with the file suffix and content type used for downloads
+ENCODINGS = {
+    "zstd": (".zst", "application/zstd"),
+    "gzip": (".gz", "application/gzip"),
+}
+COMPRESS_PARAMS = {"gz": "gzip", "gzip": "gzip", "zst": "zstd", "zstd": "zstd"}
+
+
+def get_available_encodings():
+    return [encoding for encoding in ENCODINGS if encoding != "zstd" or zstandard is not None]
+
+
+def get_compressor(encoding):
+    """Incremental compressor, with compress(data) and flush() methods"""
+    if encoding == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError("Unsupported encoding %r" % encoding)
+
+
+def negotiate_encoding(accept_encoding):
+    """Preferred available encoding of an Accept-Encoding header, if any"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0
+        accepted[name.strip().lower()] = quality
+    for encoding in get_available_encodings():
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def compress_chunks(chunks, encoding, charset="utf-8"):
+    compressor = get_compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode(charset)
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class CompressedOutput:
+    """Text output compressed as it is written, a slice at a time,
+    so the encoded text is never held in full
+    """
+
+    slice_size = 64 * 1024
+
+    def __init__(self, encoding, charset="utf-8"):
+        self.compressor = get_compressor(encoding)
+        self.charset = charset
+        self.buffer = BytesIO()
+
+    def write(self, content):
+        for start in range(0, len(content), self.slice_size):
+            end = start + self.slice_size
+            data = content[start:end]
+            if isinstance(data, str):
+                data = data.encode(self.charset)
+            self.buffer.write(self.compressor.compress(data))
+        return len(content)
+
+    def getvalue(self):
+        self.buffer.write(self.compressor.flush())
+        return self.buffer.getvalue()
+
+
+def get_export_encoding(context):
+    """Content encoding of the export the renderer context belongs to"""
+    return get_export_attr(context, "export_encoding")
@@ -0,0 +1,205 @@
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.urls import resolve
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+EXPORT_JOB_STORE = getattr(settings, "EXPORT_JOB_STORE", "unicef_rest_export.jobs.FileSystemJobStore")
+EXPORT_JOB_ROOT = getattr(settings, "EXPORT_JOB_ROOT", os.path.join(tempfile.gettempdir(), "unicef_rest_export"))
+EXPORT_JOB_EXECUTOR = getattr(settings, "EXPORT_JOB_EXECUTOR", "thread")
+EXPORT_JOB_WORKERS = getattr(settings, "EXPORT_JOB_WORKERS", 2)
+# seconds jobs and their results are kept after their last update
+EXPORT_JOB_EXPIRY = getattr(settings, "EXPORT_JOB_EXPIRY", 24 * 60 * 60)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+JOB_ID_RE = re.compile("^[0-9a-f]{32}$")
+
+_executor = None
+
+
+class BaseJobStore:
+    """Keeps track of export jobs and their results.
+    Subclass and point EXPORT_JOB_STORE at it to keep jobs elsewhere,
+    job state is a json serializable dict.
+    """
+
+    def create(self, **state):
+        job_id = uuid.uuid4().hex
+        self.set(job_id, dict(state, id=job_id, status=PENDING))
+        return job_id
+
+    def update(self, job_id, **state):
+        job = self.get(job_id)
+        job.update(state)
+        self.set(job_id, job)
+        return job
+
+    def get(self, job_id):
+        raise NotImplementedError
+
+    def set(self, job_id, job):
+        raise NotImplementedError
+
+    def save_result(self, job_id, chunks):
+        raise NotImplementedError
+
+    def open_result(self, job_id):
+        raise NotImplementedError
+
+    def delete(self, job_id):
+        raise NotImplementedError
+
+    def delete_expired(self, max_age):
+        """Delete the jobs, and their results, not updated in max_age seconds"""
+        raise NotImplementedError
+
+
+class FileSystemJobStore(BaseJobStore):
+    """Keeps jobs as json files, next to their results, in EXPORT_JOB_ROOT"""
+
+    def __init__(self, root=None):
+        self.root = root or EXPORT_JOB_ROOT
+        os.makedirs(self.root, exist_ok=True)
+
+    def get_path(self, job_id, extension):
+        if not JOB_ID_RE.match(job_id):
+            raise ValueError("Invalid job id %r" % job_id)
+        return os.path.join(self.root, "{}.{}".format(job_id, extension))
+
+    def get(self, job_id):
+        try:
+            with open(self.get_path(job_id, "json")) as fp:
+                return json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def set(self, job_id, job):
+        path = self.get_path(job_id, "json")
+        with open(path + ".tmp", "w") as fp:
+            json.dump(job, fp)
+        os.replace(path + ".tmp", path)
+
+    def save_result(self, job_id, chunks):
+        with open(self.get_path(job_id, "result"), "wb") as fp:
+            for chunk in chunks:
+                fp.write(chunk)
+
+    def open_result(self, job_id):
+        return open(self.get_path(job_id, "result"), "rb")
+
+    def delete(self, job_id):
+        for extension in ("json", "result"):
+            try:
+                os.unlink(self.get_path(job_id, extension))
+            except FileNotFoundError:
+                pass
+
+    def delete_expired(self, max_age):
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.root):
+            job_id, _, extension = name.partition(".")
+            if extension != "json" or not JOB_ID_RE.match(job_id):
+                continue
+            try:
+                expired = os.path.getmtime(os.path.join(self.root, name)) < cutoff
+            except FileNotFoundError:
+                continue
+            if expired:
+                self.delete(job_id)
+
+
+def get_job_store():
+    return import_string(EXPORT_JOB_STORE)()
+
+
+def get_executor():
+    """Pool running the export jobs, either threads or processes
+    depending on EXPORT_JOB_EXECUTOR
+    """
+    global _executor
+    if _executor is None:
+        if EXPORT_JOB_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(
+                max_workers=EXPORT_JOB_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=django.setup,
+            )
+        else:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_JOB_WORKERS, thread_name_prefix="export")
+    return _executor
+
+
+def run_export(job_id, path, params, user_pk, host, secure, accept=None):
+    """Replay the export request synchronously and keep its output.
+    Only takes picklable arguments, so it can run in a process pool.
+    """
+    from django.test.client import RequestFactory
+
+    store = get_job_store()
+    store.update(job_id, status=RUNNING)
+    try:
+        headers = {"HTTP_HOST": host}
+        if accept:
+            # the format may have been negotiated from the Accept header
+            headers["HTTP_ACCEPT"] = accept
+        request = RequestFactory().get(path, params, secure=secure, **headers)
+        if user_pk is not None:
+            request._force_auth_user = get_user_model()._default_manager.get(pk=user_pk)
+        match = resolve(path)
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        if not 200 <= response.status_code < 300:
+            store.update(job_id, status=FAILED, error="Export failed with status %s" % response.status_code)
+            return
+        store.save_result(job_id, response.streaming_content if response.streaming else [response.content])
+        response.close()
+        store.update(job_id, status=DONE, content_type=response["Content-Type"])
+    except Exception as e:
+        logger.exception("Export job %s failed", job_id)
+        store.update(job_id, status=FAILED, error=str(e))
+    finally:
+        connections.close_all()
+
+
+def get_job_owner(request):
+    return str(request.user.pk) if request.user.is_authenticated else None
+
+
+def start_export_job(request, params):
+    """Queue the export of the request, returning the job id.
+    Expired jobs are deleted first, see EXPORT_JOB_EXPIRY
+    """
+    store = get_job_store()
+    if EXPORT_JOB_EXPIRY:
+        store.delete_expired(EXPORT_JOB_EXPIRY)
+    user_pk = request.user.pk if request.user.is_authenticated else None
+    job_id = store.create(user=get_job_owner(request), path=request.path_info)
+    get_executor().submit(
+        run_export,
+        job_id,
+        request.path_info,
+        params,
+        user_pk,
+        request.get_host(),
+        request.is_secure(),
+        request.META.get("HTTP_ACCEPT"),
+    )
+    return job_id
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+
+from django.conf import settings
+from django.core.signals import request_started, setting_changed
+from django.utils.autoreload import file_changed
+
+EXPORT_METADATA_CACHE = getattr(settings, "EXPORT_METADATA_CACHE", True)
+EXPORT_METADATA_CACHE_SIZE = getattr(settings, "EXPORT_METADATA_CACHE_SIZE", 256)
+
+
+class MetadataRegistry:
+    """Process wide cache of what can be worked out once per serializer
+    class rather than on every request; field order, labels, values_list
+    columns, related lookups.
+    Keys include the fields a request asks for, so it holds at most
+    maxsize entries, dropping the least recently used.
+    Cleared on autoreload, when settings change and, with DEBUG on,
+    at the start of every request.
+    """
+
+    def __init__(self, maxsize=EXPORT_METADATA_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, factory):
+        with self.lock:
+            try:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            except KeyError:
+                pass
+        value = factory()
+        with self.lock:
+            self.entries[key] = value
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self, **kwargs):
+        with self.lock:
+            self.entries.clear()
+
+
+registry = MetadataRegistry()
+
+
+def clear_in_debug(**kwargs):
+    if settings.DEBUG:
+        registry.clear()
+
+
+file_changed.connect(registry.clear, dispatch_uid="unicef_rest_export.metadata")
+setting_changed.connect(registry.clear, dispatch_uid="unicef_rest_export.metadata")
+request_started.connect(clear_in_debug, dispatch_uid="unicef_rest_export.metadata")
+
+
+def is_metadata_cached(view):
+    """Views whose serializer fields depend on the request turn it off
+    with export_metadata_cache = False
+    """
+    return getattr(view, "export_metadata_cache", EXPORT_METADATA_CACHE)
+
+
+@lru_cache(maxsize=None)
+def has_static_fields(serializer_class):
+    """Whether every instance of the serializer class has the same fields,
+    that is __init__, get_fields and fields are rest_framework's own.
+    Serializers overriding them usually pick their fields from the context
+    """
+    for name in ("__init__", "get_fields", "fields"):
+        owner = next(cls for cls in serializer_class.__mro__ if name in vars(cls))
+        if not owner.__module__.startswith("rest_framework."):
+            return False
+    return True
+
+
+class SerializerMetadata:
+    """Readable fields of a serializer, in order, and their labels.
+    Derived metadata (i.e. values_list columns for a model) is computed
+    once through get, from the serializer it was built with.
+    """
+
+    def __init__(self, serializer, field_names=None):
+        self.serializer = serializer
+        fields = serializer.fields
+        if field_names is not None:
+            trimmed = [(name, fields[name]) for name in field_names]
+            fields.fields.clear()
+            fields.fields.update(trimmed)
+        self.field_names = [name for name, field in fields.items() if not field.write_only]
+        self.labels = {name: fields[name].label for name in self.field_names}
+        self.derived = {}
+
+    def get_label(self, field_name):
+        return self.labels.get(field_name, field_name)
+
+    def get(self, key, factory):
+        try:
+            return self.derived[key]
+        except KeyError:
+            pass
+        value = self.derived[key] = factory(self.serializer)
+        return value
+
+
+def get_serializer_metadata(serializer):
+    """Metadata of a (child) serializer, shared by every instance of its
+    class with the same fields. The shared one is built from an instance
+    of its own, so it does not hold on to the request, unless the fields
+    of the class may depend on it
+    """
+    field_names = getattr(serializer, "export_field_names", None)
+    serializer_class = type(serializer)
+    if not is_metadata_cached(serializer.context.get("view")) or not has_static_fields(serializer_class):
+        return SerializerMetadata(serializer, field_names)
+    return registry.get(
+        ("serializer", serializer_class, field_names),
+        lambda: SerializerMetadata(serializer_class(), field_names),
+    )
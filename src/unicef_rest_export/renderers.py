@@ -1,20 +1,57 @@
+import csv
+import json
+import logging
+import math
+import multiprocessing
 import os
+import re
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from copy import deepcopy
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from functools import lru_cache
+from importlib.util import find_spec
 from io import BytesIO, StringIO
-from tempfile import mkstemp
-
-from docx import Document
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import landscape, letter
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Table, TableStyle
-from reportlab.platypus.doctemplate import LayoutError
+from itertools import chain, islice
+from pickle import PicklingError
+from tempfile import SpooledTemporaryFile
+from uuid import UUID
+from xml.sax.saxutils import escape
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import django
+from django.conf import settings
+from django.utils.html import format_html, format_html_join
 from rest_framework import status
 from rest_framework.renderers import BaseRenderer, TemplateHTMLRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework_csv.renderers import CSVRenderer
 from tablib import Dataset
 
+from unicef_rest_export.budgets import get_export_budget, NULL_BUDGET
+from unicef_rest_export.compression import CompressedOutput, get_export_encoding
+from unicef_rest_export.serializers import ILLEGAL_CHARACTERS_RE, iter_dataset_rows
+from unicef_rest_export.timing import get_export_timer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
 RESPONSE_ERROR = "Response data is a %s, not a Dataset! " "Did you extend ExportMixin?"
 PDF_COLUMNS_PER_PAGE = 9
+PARAGRAPH_MARKUP = re.compile("[<>&]")
+EXPORT_SPOOL_MAX_SIZE = getattr(settings, "EXPORT_SPOOL_MAX_SIZE", 10 * 1024 * 1024)
+EXPORT_SPOOL_DIR = getattr(settings, "EXPORT_SPOOL_DIR", None)
+EXPORT_HTML_MAX_ROWS = getattr(settings, "EXPORT_HTML_MAX_ROWS", None)
+EXPORT_PDF_WORKERS = getattr(settings, "EXPORT_PDF_WORKERS", 0)
+EXPORT_PDF_BLOCK_SIZE = getattr(settings, "EXPORT_PDF_BLOCK_SIZE", 1000)
+DOCX_DOCUMENT = "word/document.xml"
+DOCX_PAGE_BREAK = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+HTML_TABLE_MARKER = "<!-- unicef_rest_export:table -->"
 
 
 class ExportBaseRenderer(BaseRenderer):
@@ -23,6 +60,11 @@ class ExportBaseRenderer(BaseRenderer):
     Uses a StringIO to capture the output of dataset.export('[format]')
     """
 
+    # text output that the view may compress, see ExportMixin.get_export_encoding
+    compressible = False
+    # limits of the export being rendered, see ExportMixin.get_export_budget
+    budget = NULL_BUDGET
+
     def render(self, data, accepted_media_type=None, renderer_context=None):
         if "response" in renderer_context:
             status_code = renderer_context["response"].status_code
@@ -32,13 +74,34 @@ class ExportBaseRenderer(BaseRenderer):
         if not isinstance(data, Dataset):
             raise Exception(RESPONSE_ERROR % type(data).__name__)
 
-        self.init_output()
-        args = self.get_export_args(data)
-        kwargs = self.get_export_kwargs(data, renderer_context)
-        self.render_dataset(data, *args, **kwargs)
-        return self.get_output()
+        timer = get_export_timer(renderer_context)
+        with timer.stage("render"):
+            self.init_output()
+            encoding = self.get_content_encoding(renderer_context)
+            if encoding:
+                self.output = CompressedOutput(encoding, self.charset)
+            self.budget = get_export_budget(renderer_context)
+            self.output = self.budget.wrap_output(self.output)
+            args = self.get_export_args(data)
+            kwargs = self.get_export_kwargs(data, renderer_context)
+            self.render_dataset(data, *args, **kwargs)
+            output = self.get_output()
+        if timer.enabled:
+            timer.rows = data.height
+            timer.size = self.get_output_size(output)
+        return output
+
+    def get_content_encoding(self, renderer_context):
+        return get_export_encoding(renderer_context) if self.compressible else None
+
+    def get_output_size(self, output):
+        if isinstance(output, (bytes, str)):
+            return len(output)
+        return os.fstat(output.fileno()).st_size
 
     def render_dataset(self, data, *args, **kwargs):
+        # tablib renders in one go, the budget is only checked around it
+        self.budget.check_time()
         self.output.write(data.export(self.format))
 
     def init_output(self):
@@ -55,33 +118,35 @@ class ExportBaseRenderer(BaseRenderer):
 
 
 class ExportFileRenderer(ExportBaseRenderer):
-    """Renderer for output formats that absolutely must use a file
-    (i.e. Excel)
+    """Renderer for binary output formats (i.e. Excel).
+    Output is kept in memory up to spool_max_size bytes, larger
+    output spills over to a temporary file in spool_dir, which
+    is handed back as is for the response to stream from.
     """
 
-    def init_output(self):
-        file, filename = mkstemp(suffix="." + self.format)
-        self.filename = filename
-        os.close(file)
+    spool_max_size = EXPORT_SPOOL_MAX_SIZE
+    spool_dir = EXPORT_SPOOL_DIR
 
-    def render_dataset(self, data, *args, **kwargs):
-        with open(self.filename, "wb") as fp:
-            fp.write(data.export(self.format))
+    def get_buffer(self):
+        return SpooledTemporaryFile(max_size=self.spool_max_size, dir=self.spool_dir)
 
-    def get_export_args(self, data):
-        return [self.filename]
+    def init_output(self):
+        self.output = self.get_buffer()
 
     def get_output(self):
-        file = open(self.filename, "rb")
-        result = file.read()
-        file.close()
-        os.unlink(self.filename)
+        size = self.output.tell()
+        self.output.seek(0)
+        if size > self.spool_max_size:
+            return self.output
+        result = self.output.read()
+        self.output.close()
         return result
 
 
 class ExportHTMLRenderer(TemplateHTMLRenderer, ExportBaseRenderer):
     media_type = "text/html"
     format = "html"
+    compressible = True
 
     def render(self, data, accepted_media_type=None, renderer_context=None):
         table = ExportBaseRenderer.render(
@@ -91,12 +156,23 @@ class ExportHTMLRenderer(TemplateHTMLRenderer, ExportBaseRenderer):
             renderer_context,
         )
 
-        return TemplateHTMLRenderer.render(
+        content = TemplateHTMLRenderer.render(
             self,
             {"table": table},
             accepted_media_type,
             renderer_context,
         )
+        # the table is only part of the page, compress the whole page instead
+        encoding = get_export_encoding(renderer_context)
+        response = renderer_context.get("response") if renderer_context else None
+        if encoding and (response is None or status.is_success(response.status_code)):
+            output = CompressedOutput(encoding, self.charset)
+            output.write(content)
+            return output.getvalue()
+        return content
+
+    def get_content_encoding(self, renderer_context):
+        return None
 
     def get_template_context(self, data, renderer_context):
         view = renderer_context["view"]
@@ -104,18 +180,38 @@ class ExportHTMLRenderer(TemplateHTMLRenderer, ExportBaseRenderer):
 
         data["name"] = view.get_view_name()
         data["description"] = view.get_view_description(html=True)
-        data["url"] = request.path.replace(".html", "")
-        full_path = request.get_full_path()
-        if "?" in full_path:
-            fr = full_path.index("?")
-            data["url_params"] = full_path[fr:]
-        data["available_formats"] = [cls.format for cls in view.renderer_classes if cls.format != "html"]
+        data["url"], url_params = self.get_url(request)
+        if url_params:
+            data["url_params"] = url_params
+        data["available_formats"] = self.get_available_formats(view)
+        data["format_links"] = [(format, self.get_format_url(request, format)) for format in data["available_formats"]]
 
         if hasattr(view, "get_template_context"):
             data.update(view.get_template_context(data))
 
         return data
 
+    def get_url(self, request):
+        """Url of the export without the format, and its query string"""
+        _, mark, query = request.get_full_path().partition("?")
+        return request.path.replace(".html", ""), mark + query
+
+    def get_format_url(self, request, format):
+        """Url of the export in another format, the format query parameter
+        replaced rather than kept, as it takes over from a format suffix
+        only when there are no suffix patterns
+        """
+        url, url_params = self.get_url(request)
+        param = api_settings.URL_FORMAT_OVERRIDE
+        if not param:
+            return "{}.{}{}".format(url, format, url_params)
+        params = request.GET.copy()
+        params[param] = format
+        return "{}?{}".format(url, params.urlencode())
+
+    def get_available_formats(self, view):
+        return [cls.format for cls in view.renderer_classes if cls.format != "html"]
+
     def get_export_kwargs(self, data, renderer_context):
         return {
             "classes": "ui-table table-stripe",
@@ -130,16 +226,80 @@ class ExportCSVRenderer(ExportBaseRenderer):
 
     media_type = "text/csv"
     format = "csv"
+    compressible = True
 
     def get_export_kwargs(self, data, renderer_context):
         return {"encoding": self.charset}
 
 
+class Echo:
+    """File-like object that hands back whatever is written to it"""
+
+    def write(self, value):
+        return value
+
+
+class ChunkBuffer:
+    """Write only file-like object, collecting bytes until drained"""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, value):
+        self.chunks.append(bytes(value))
+        self.size += len(value)
+        return len(value)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        content = b"".join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return content
+
+
+class ExportStreamingRenderer(ExportBaseRenderer):
+    """Renders rows as they are produced instead of a complete Dataset.
+    Views extending ExportMixin answer with a StreamingHttpResponse
+    when one of these is the accepted renderer, feeding render_stream
+    with the queryset chunk by chunk.
+    """
+
+    streaming = True
+
+    def render_stream(self, headers, rows, renderer_context):
+        kwargs = self.get_export_kwargs(None, renderer_context)
+        return self.stream_rows(headers, rows, **kwargs)
+
+    def stream_rows(self, headers, rows, **kwargs):
+        raise NotImplementedError
+
+    def render_dataset(self, data, *args, **kwargs):
+        rows = self.budget.iter_rows(iter_dataset_rows(data))
+        for chunk in self.stream_rows(data.headers or [], rows, **kwargs):
+            self.output.write(chunk)
+
+
+class ExportStreamingCSVRenderer(ExportStreamingRenderer, ExportCSVRenderer):
+    """Renders rows as CSV lines, one at a time"""
+
+    def stream_rows(self, headers, rows, **kwargs):
+        writer = csv.writer(Echo())
+        if headers:
+            yield writer.writerow(headers)
+        for row in rows:
+            yield writer.writerow(row)
+
+
 class ExportJSONRenderer(ExportBaseRenderer):
     """Renders dataset as JSON"""
 
     media_type = "application/json"
     format = "json"
+    compressible = True
 
     date_format_choices = {"epoch", "iso"}
     default_date_format = "iso"
@@ -156,6 +316,131 @@ class ExportJSONRenderer(ExportBaseRenderer):
         }
 
 
+def get_json_default(date_format):
+    """Fallback of the json encoders, dates being either iso formatted
+    or, for epoch, milliseconds since the epoch (naive ones taken as UTC)
+    """
+
+    def default(obj):
+        if isinstance(obj, (Decimal, UUID)):
+            return str(obj)
+        if date_format == "epoch" and isinstance(obj, date):
+            if not isinstance(obj, datetime):
+                obj = datetime(obj.year, obj.month, obj.day)
+            if obj.tzinfo is None:
+                obj = obj.replace(tzinfo=timezone.utc)
+            return int(obj.timestamp() * 1000)
+        if hasattr(obj, "isoformat"):
+            return obj.isoformat()
+        return str(obj)
+
+    return default
+
+
+def get_json_encoder(date_format):
+    """Function encoding an object as json text, with orjson when installed"""
+    default = get_json_default(date_format)
+    if orjson is not None:
+        option = orjson.OPT_PASSTHROUGH_DATETIME if date_format == "epoch" else 0
+        return lambda obj: orjson.dumps(obj, default=default, option=option).decode("utf-8")
+    return json.JSONEncoder(default=default, ensure_ascii=False).encode
+
+
+class ExportStreamingJSONRenderer(ExportStreamingRenderer, ExportJSONRenderer):
+    """Renders rows as a JSON array of objects, an object at a time"""
+
+    def stream_rows(self, headers, rows, date_format=ExportJSONRenderer.default_date_format, **kwargs):
+        encode = get_json_encoder(date_format)
+        yield "["
+        for i, row in enumerate(rows):
+            yield ("," if i else "") + encode(dict(zip(headers, row)))
+        yield "]"
+
+
+class ExportNDJSONRenderer(ExportStreamingRenderer, ExportJSONRenderer):
+    """Renders rows as newline delimited JSON, an object per line"""
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+    def stream_rows(self, headers, rows, date_format=ExportJSONRenderer.default_date_format, **kwargs):
+        encode = get_json_encoder(date_format)
+        for row in rows:
+            yield encode(dict(zip(headers, row))) + "\n"
+
+
+class ExportStreamingHTMLRenderer(ExportStreamingRenderer, ExportHTMLRenderer):
+    """Renders rows as an HTML table, within the page of the template.
+    The page is rendered around a marker and split there, the head is sent
+    first, then the table rows a chunk at a time and the tail last.
+
+    With max_rows set, the table stops there and links to the full export
+    in the other formats follow it, sparing browsers the layout of huge tables.
+    """
+
+    max_rows = EXPORT_HTML_MAX_ROWS
+    chunk_rows = 500
+
+    def get_page(self, renderer_context):
+        """Head and tail of the page, either side of the table"""
+        view = renderer_context["view"]
+        request = renderer_context["request"]
+        response = renderer_context.get("response") or Response()
+        template = self.resolve_template(self.get_template_names(response, view))
+        context = self.get_template_context({"table": HTML_TABLE_MARKER}, renderer_context)
+        head, _, tail = template.render(context, request=request).partition(HTML_TABLE_MARKER)
+        return head, tail
+
+    def render_stream(self, headers, rows, renderer_context):
+        head, tail = self.get_page(renderer_context)
+        yield head
+        yield from super().render_stream(headers, rows, renderer_context)
+        yield tail
+
+    def get_export_kwargs(self, data, renderer_context):
+        kwargs = super().get_export_kwargs(data, renderer_context)
+        if self.max_rows is not None:
+            request = renderer_context["request"]
+            kwargs["max_rows"] = self.max_rows
+            kwargs["links"] = [
+                (format, self.get_format_url(request, format))
+                for format in self.get_available_formats(renderer_context["view"])
+            ]
+        return kwargs
+
+    def get_row(self, row, na_rep):
+        cells = (escape(str(value)) if value is not None else na_rep for value in row)
+        return "<tr>{}</tr>".format("".join("<td>{}</td>".format(cell) for cell in cells))
+
+    def get_truncated_notice(self, max_rows, links):
+        notice = format_html("Showing the first {} rows.", max_rows)
+        if links:
+            notice = format_html(
+                "{} Download the full export as {}.",
+                notice,
+                format_html_join(", ", '<a href="{}" rel="external">{}</a>', ((url, format) for format, url in links)),
+            )
+        return format_html('<p class="export-truncated">{}</p>', notice)
+
+    def stream_rows(self, headers, rows, classes="", na_rep="", max_rows=None, links=(), **kwargs):
+        yield format_html('<table class="{}">', classes) if classes else "<table>"
+        if headers:
+            yield "<thead><tr>{}</tr></thead>".format(
+                "".join("<th>{}</th>".format(escape(str(header))) for header in headers)
+            )
+        yield "<tbody>"
+        rows = iter(rows)
+        shown = islice(rows, max_rows) if max_rows is not None else rows
+        while True:
+            chunk = list(islice(shown, self.chunk_rows))
+            if not chunk:
+                break
+            yield "".join(self.get_row(row, na_rep) for row in chunk)
+        yield "</tbody></table>"
+        if max_rows is not None and next(rows, None) is not None:
+            yield self.get_truncated_notice(max_rows, links)
+
+
 class ExportOpenXMLRenderer(ExportFileRenderer):
     """Renders dataset as Excel (.xlsx)"""
 
@@ -163,6 +448,78 @@ class ExportOpenXMLRenderer(ExportFileRenderer):
     format = "xlsx"
 
 
+class ExportStreamingOpenXMLRenderer(ExportStreamingRenderer, ExportOpenXMLRenderer):
+    """Renders rows as Excel (.xlsx) using openpyxl's write-only mode.
+    Rows are written to the workbook as they arrive, and the saved file
+    is streamed back in chunks rather than read into memory.
+    """
+
+    sheet_title = "Tablib Dataset"
+    width_sample_size = 100
+    chunk_size = 64 * 1024
+
+    def get_cell(self, worksheet, value):
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.cell.cell import KNOWN_TYPES
+        from openpyxl.styles import Alignment
+
+        if not isinstance(value, KNOWN_TYPES):
+            value = str(value)
+        if isinstance(value, str) and "\n" in value:
+            cell = WriteOnlyCell(worksheet, value)
+            cell.alignment = Alignment(wrap_text=True)
+            return cell
+        return value
+
+    def write_sheet(self, workbook, title, headers, rows):
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+        from openpyxl.utils import get_column_letter
+
+        worksheet = workbook.create_sheet(title)
+
+        # column widths have to be set before any row is written,
+        # so size them on the first rows only
+        sample = list(islice(rows, self.width_sample_size))
+        widths = [len(str(header)) for header in headers]
+        for row in sample:
+            for i, value in enumerate(row):
+                if i < len(widths):
+                    widths[i] = max(widths[i], len(str(value)))
+        for i, width in enumerate(widths, 1):
+            worksheet.column_dimensions[get_column_letter(i)].width = width
+
+        if headers:
+            worksheet.freeze_panes = "A2"
+            bold = Font(bold=True)
+            header_cells = []
+            for header in headers:
+                cell = WriteOnlyCell(worksheet, header)
+                cell.font = bold
+                header_cells.append(cell)
+            worksheet.append(header_cells)
+
+        for row in chain(sample, rows):
+            worksheet.append([self.get_cell(worksheet, value) for value in row])
+
+    def get_workbook(self):
+        from openpyxl import Workbook
+
+        return Workbook(write_only=True)
+
+    def stream_workbook(self, workbook):
+        """Save the workbook and stream the file back in chunks"""
+        with self.get_buffer() as fp:
+            workbook.save(fp)
+            fp.seek(0)
+            yield from iter(lambda: fp.read(self.chunk_size), b"")
+
+    def stream_rows(self, headers, rows, **kwargs):
+        workbook = self.get_workbook()
+        self.write_sheet(workbook, self.sheet_title, headers, rows)
+        yield from self.stream_workbook(workbook)
+
+
 class ExportExcelRenderer(ExportFileRenderer):
     """Renders dataset as Excel (.xls)"""
 
@@ -170,111 +527,375 @@ class ExportExcelRenderer(ExportFileRenderer):
     format = "xls"
 
 
-class ExportPDFTableRenderer(ExportFileRenderer):
-    """Renders dataset as PDF (.pdf) in table format"""
+@lru_cache(maxsize=None)
+def get_pdf_executor(workers):
+    """Process pool rendering pdf parts, started on first use"""
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=django.setup,
+    )
+
+
+@lru_cache(maxsize=None)
+def has_pdf_writer():
+    """Whether pypdf is installed, to merge the parts rendered in parallel"""
+    return find_spec("pypdf") is not None
+
+
+def render_pdf_part(renderer_class, *args):
+    """Entry point of the pdf worker processes"""
+    return renderer_class().export_part(*args)
+
+
+class ExportPDFBaseRenderer(ExportFileRenderer):
+    """Renders the dataset in a single process by default.
+    With pdf_workers set, and pypdf installed, datasets over pdf_block_size
+    rows are rendered a block at a time in a process pool instead,
+    and the resulting documents merged in order.
+    """
 
     media_type = "application/pdf"
+    pdf_workers = EXPORT_PDF_WORKERS
+    pdf_block_size = EXPORT_PDF_BLOCK_SIZE
+
+    def get_style(self):
+        from reportlab.lib.styles import getSampleStyleSheet
+
+        style = getSampleStyleSheet()["Normal"]
+        style.fontSize = 7
+        return style
+
+    def get_blocks(self, rows):
+        for offset in range(0, len(rows), self.pdf_block_size):
+            end = offset + self.pdf_block_size
+            yield offset, rows[offset:end]
+
+    def check_page(self, canvas, doc):
+        """Check the time budget as every page is laid out"""
+        self.budget.check_time()
+
+    def build(self, doc, elements):
+        doc.build(elements, onFirstPage=self.check_page, onLaterPages=self.check_page)
+
+    def use_parallel(self, rows):
+        return bool(self.pdf_workers) and has_pdf_writer() and len(rows) > self.pdf_block_size
+
+    def export_parallel(self, parts):
+        """Render the parts in the process pool and merge them,
+        None when the pool is not usable, to fall back on a single process
+        """
+        try:
+            executor = get_pdf_executor(self.pdf_workers)
+            futures = [executor.submit(render_pdf_part, type(self), *args) for args in parts]
+            contents = []
+            try:
+                for future in futures:
+                    contents.append(future.result())
+                    self.budget.check_time()
+            finally:
+                for future in futures:
+                    future.cancel()
+        except (BrokenExecutor, OSError, PicklingError) as e:
+            logger.warning("Parallel pdf rendering failed, rendering in process: %s", e)
+            get_pdf_executor.cache_clear()
+            return None
+
+        from pypdf import PdfWriter
+
+        writer = PdfWriter()
+        for content in contents:
+            writer.append(BytesIO(content))
+        stream = BytesIO()
+        writer.write(stream)
+        return stream.getvalue()
+
+
+class ExportPDFTableRenderer(ExportPDFBaseRenderer):
+    """Renders dataset as PDF (.pdf) in table format"""
+
     format = "pdf_table"
 
-    def export_set(self, formatted, headers, columns_per_page):
+    # sizes, in points, used when planning the layout of the columns
+    cell_padding = 12
+    header_font_size = 10
+    min_column_width = 36
+    layout_sample_size = 200
+
+    def measure_columns(self, formatted, headers, style):
+        """Return the minimum and natural width of each column, measured
+        on the header and a sample of rows spread over the dataset.
+        The minimum width fits the longest word, the natural width the
+        whole text on a single line.
+        """
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+
+        step = max(1, len(formatted) // self.layout_sample_size)
+        sample = formatted[::step]
+        columns = []
+        for i, header in enumerate(headers):
+            header = str(header) if header is not None else ""
+            header_width = stringWidth(header, style.fontName, self.header_font_size)
+            minimum = max(header_width, self.min_column_width - self.cell_padding)
+            natural = header_width
+            for row in sample:
+                text = str(row[i])
+                natural = max(natural, stringWidth(text, style.fontName, style.fontSize))
+                for word in text.split():
+                    minimum = max(minimum, stringWidth(word, style.fontName, style.fontSize))
+            columns.append((minimum + self.cell_padding, max(natural, minimum) + self.cell_padding))
+        return columns
+
+    def distribute_width(self, columns, width):
+        """Give each column its natural width if they all fit,
+        otherwise share the space left over the minimum widths
+        in proportion to how much each column would need
+        """
+        minimums = [minimum for minimum, _ in columns]
+        naturals = [natural for _, natural in columns]
+        if sum(naturals) <= width:
+            return naturals
+        extra = max(0, width - sum(minimums))
+        slack = sum(naturals) - sum(minimums)
+        if not slack:
+            # the widest values are single words, nothing left to share
+            return minimums
+        return [minimum + extra * (natural - minimum) / slack for minimum, natural in columns]
+
+    def estimate_row_height(self, columns, widths, style):
+        """Height of the tallest row, assuming the widest sampled cells of
+        each column share a row, with some allowance for word wrapping
+        """
+        height = 0
+        for (_, natural), width in zip(columns, widths):
+            lines = math.ceil(1.1 * (natural - self.cell_padding) / max(width - self.cell_padding, 1))
+            height = max(height, max(lines, 1) * style.leading + self.cell_padding / 2)
+        return height
+
+    def plan_layout(self, formatted, headers, style, width, height):
+        """Group the columns into page wide tables, returning the start and
+        end of each group along with its column widths (the row number
+        column included), so the document only has to be built once
+        """
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+
+        row_width = self.cell_padding + max(
+            stringWidth("Row", style.fontName, self.header_font_size),
+            stringWidth(str(len(formatted)), style.fontName, self.header_font_size),
+        )
+        width -= row_width
+        columns = self.measure_columns(formatted, headers, style)
+
+        layout = []
+        start = 0
+        while start < len(columns):
+            end = start + 1
+            while end < len(columns) and end - start < PDF_COLUMNS_PER_PAGE:
+                stop = end + 1
+                candidate = columns[start:stop]
+                if sum(minimum for minimum, _ in candidate) > width:
+                    break
+                widths = self.distribute_width(candidate, width)
+                if self.estimate_row_height(candidate, widths, style) > height:
+                    break
+                end += 1
+            layout.append((start, end, [row_width] + self.distribute_width(columns[start:end], width)))
+            start = end
+        return layout
+
+    def get_cell(self, value, width, style):
+        """Plain text that fits on a single line is drawn by the table
+        as is, anything else needs a Paragraph to handle markup and wrapping
+        """
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        from reportlab.platypus import Paragraph
+
+        text = str(value)
+        if (
+            not PARAGRAPH_MARKUP.search(text)
+            and " ".join(text.split()) == text
+            and stringWidth(text, style.fontName, style.fontSize) <= width - self.cell_padding
+        ):
+            return text
+        return Paragraph(text, style)
+
+    def get_document(self, stream):
+        from reportlab.lib.pagesizes import landscape, letter
+        from reportlab.platypus import SimpleDocTemplate
+
+        return SimpleDocTemplate(stream, pagesize=landscape(letter))
+
+    def get_table(self, headers, rows, col_widths, style, first_row=1):
+        from reportlab.lib import colors
+        from reportlab.platypus import Table, TableStyle
+
+        data = [["Row"] + [item if item is not None else "" for item in headers]]
+        for row_num, row in enumerate(self.budget.iter_rows(rows), first_row):
+            data.append([row_num] + [self.get_cell(v, width, style) for v, width in zip(row, col_widths[1:])])
+
+        t = Table(data, colWidths=col_widths)
+        t.setStyle(
+            TableStyle(
+                [
+                    # action/format, from-cell, to-cell, format
+                    ("VALIGN", (0, 0), (-1, -1), "TOP"),
+                    ("FONTSIZE", (1, 1), (-1, -1), style.fontSize),
+                    ("LEADING", (1, 1), (-1, -1), style.leading),
+                    ("INNERGRID", (0, 0), (-1, -1), 0.25, colors.black),
+                    ("BOX", (0, 0), (-1, -1), 0.25, colors.black),
+                ]
+            )
+        )
+        return t
+
+    def get_parts(self, rows, headers, layout):
+        for start, end, col_widths in layout:
+            for offset, block in self.get_blocks(rows):
+                yield headers[start:end], [[str(v) for v in row[start:end]] for row in block], col_widths, offset + 1
+
+    def export_part(self, headers, rows, col_widths, first_row):
+        stream = BytesIO()
+        doc = self.get_document(stream)
+        self.build(doc, [self.get_table(headers, rows, col_widths, self.get_style(), first_row)])
+        return stream.getvalue()
+
+    def export_set(self, formatted, headers):
+        from reportlab.platypus import PageBreak
+
         stream = BytesIO()
-        doc = SimpleDocTemplate(stream, pagesize=landscape(letter))
-        styles = getSampleStyleSheet()
-        styleCell = styles["Normal"]
-        styleCell.fontSize = 7
+        doc = self.get_document(stream)
+        styleCell = self.get_style()
         elements = []
 
         if headers:
-            # slice the data into a set number of columns
+            # slice the data into groups of columns
             # in order to fit on the page
-            for start in range(0, len(headers), columns_per_page):
-                end = start + columns_per_page
-                data = [["Row"] + [item if item is not None else "" for item in headers[start:end]]]
-
-                row_num = 1
-                for row in formatted:
-                    d = [Paragraph(str(v), styleCell) for _, v in row.items()]
-                    data.append([row_num] + d[start:end])
-                    row_num += 1
-
-                t = Table(data)
-                t.setStyle(
-                    TableStyle(
-                        [
-                            # action/format, from-cell, to-cell, format
-                            ("VALIGN", (0, 0), (-1, -1), "TOP"),
-                            ("INNERGRID", (0, 0), (-1, -1), 0.25, colors.black),
-                            ("BOX", (0, 0), (-1, -1), 0.25, colors.black),
-                        ]
-                    )
+            rows = [list(row.values()) for row in formatted]
+            # the page frame has 6 points of padding on each side
+            layout = self.plan_layout(rows, headers, styleCell, doc.width - 12, doc.height - 12)
+            if self.use_parallel(rows):
+                content = self.export_parallel(self.get_parts(rows, headers, layout))
+                if content is not None:
+                    return content
+
+            for start, end, col_widths in layout:
+                elements.append(
+                    self.get_table(headers[start:end], [row[start:end] for row in rows], col_widths, styleCell)
                 )
-                elements.append(t)
                 elements.append(PageBreak())
 
-        doc.build(elements)
+        self.build(doc, elements)
         return stream.getvalue()
 
     def export_failure(self):
+        from reportlab.platypus import Paragraph
+
         stream = BytesIO()
-        doc = SimpleDocTemplate(stream, pagesize=landscape(letter))
-        styles = getSampleStyleSheet()
-        styleCell = styles["Normal"]
-        styleCell.fontSize = 7
+        doc = self.get_document(stream)
         elements = [
             Paragraph(
                 ("Data not able to be formatted for PDF, " "please try another format."),
-                styleCell,
+                self.get_style(),
             )
         ]
         doc.build(elements)
         return stream.getvalue()
 
     def render_dataset(self, data, *args, **kwargs):
+        from reportlab.platypus.doctemplate import LayoutError
+
         formatted = data._package()
         headers = data.headers
-        with open(self.filename, "wb") as fp:
-            columns_per_page = PDF_COLUMNS_PER_PAGE
-            success = False
-            while columns_per_page > 1:
-                try:
-                    fp.write(self.export_set(formatted, headers, columns_per_page))
-                except LayoutError:
-                    columns_per_page -= 1
-                else:
-                    success = True
-                    break
-            if not success:
-                fp.write(self.export_failure())
+        try:
+            self.output.write(self.export_set(formatted, headers))
+        except LayoutError:
+            self.output.write(self.export_failure())
 
 
-class ExportPDFRenderer(ExportFileRenderer):
+class ExportPDFRenderer(ExportPDFBaseRenderer):
     """Renders dataset as PDF (.pdf)"""
 
-    media_type = "application/pdf"
     format = "pdf"
 
-    def export_set(self, formatted):
-        stream = BytesIO()
-        doc = SimpleDocTemplate(stream)
-        styles = getSampleStyleSheet()
-        styleParagraph = styles["Normal"]
-        styleParagraph.fontSize = 7
-        elements = []
+    def get_elements(self, headers, rows, style):
+        from reportlab.platypus import PageBreak, Paragraph
 
-        for row in formatted:
+        for row in self.budget.iter_rows(rows):
             if row:
-                for k, val in row.items():
-                    p = Paragraph(f"<b>{k}:</b> {val}", styleParagraph)
-                    elements.append(p)
-                elements.append(PageBreak())
+                for k, val in zip(headers, row):
+                    yield Paragraph(f"<b>{k}:</b> {val}", style)
+                yield PageBreak()
 
-        doc.build(elements)
+    def get_parts(self, rows, headers):
+        for _, block in self.get_blocks(rows):
+            yield headers, [[str(v) for v in row] for row in block]
+
+    def export_part(self, headers, rows):
+        from reportlab.platypus import SimpleDocTemplate
+
+        stream = BytesIO()
+        doc = SimpleDocTemplate(stream)
+        self.build(doc, list(self.get_elements(headers, rows, self.get_style())))
         return stream.getvalue()
 
+    def export_set(self, formatted, headers):
+        if not headers:
+            return self.export_part([], [])
+        rows = [list(row.values()) for row in formatted]
+        if self.use_parallel(rows):
+            content = self.export_parallel(self.get_parts(rows, headers))
+            if content is not None:
+                return content
+        return self.export_part(headers, rows)
+
     def render_dataset(self, data, *args, **kwargs):
         formatted = data._package()
-        with open(self.filename, "wb") as fp:
-            fp.write(self.export_set(formatted))
+        self.output.write(self.export_set(formatted, data.headers))
+
+
+def split_docx_text(text):
+    """Split text into the run elements python-docx writes for it,
+    tabs and line breaks become their own w:tab and w:br elements
+    """
+    for i, line in enumerate(text.replace("\r", "\n").split("\n")):
+        if i:
+            yield "w:br", None
+        for j, part in enumerate(line.split("\t")):
+            if j:
+                yield "w:tab", None
+            if part:
+                yield "w:t", part
+
+
+def get_docx_run(text, bold=False):
+    parts = ["<w:r>"]
+    if bold:
+        parts.append("<w:rPr><w:b/></w:rPr>")
+    for tag, part in split_docx_text(ILLEGAL_CHARACTERS_RE.sub("", text)):
+        if part is None:
+            parts.append("<{}/>".format(tag))
+        elif part != part.strip():
+            parts.append('<w:t xml:space="preserve">{}</w:t>'.format(escape(part)))
+        else:
+            parts.append("<w:t>{}</w:t>".format(escape(part)))
+    parts.append("</w:r>")
+    return "".join(parts)
+
+
+@lru_cache(maxsize=None)
+def get_docx_template():
+    """Parts of python-docx's default document, as (name, content) pairs,
+    and the document.xml around its body content
+    """
+    from docx import Document
+
+    stream = BytesIO()
+    Document().save(stream)
+    with ZipFile(stream) as package:
+        entries = [(name, package.read(name)) for name in package.namelist()]
+    document = dict(entries)[DOCX_DOCUMENT]
+    split = document.index(b"<w:sectPr")
+    return entries, document[:split], document[split:]
 
 
 class ExportDocxBaseRenderer(ExportFileRenderer):
@@ -282,29 +903,50 @@ class ExportDocxBaseRenderer(ExportFileRenderer):
 
 
 class ExportDocxRenderer(ExportDocxBaseRenderer):
-    """Renders dataset as Doc (.docx)"""
+    """Renders dataset as Doc (.docx), a page per record.
+    The document body is written straight into the zip package as rows
+    arrive, so only one record is held in memory at a time.
+    """
 
     format = "docx"
+    chunk_size = 64 * 1024
 
-    def export_set(self, formatted):
-        stream = BytesIO()
-        doc = Document()
+    def get_record_xml(self, headers, row):
+        paragraphs = [
+            "<w:p>{}{}</w:p>".format(get_docx_run(f"{k}:", bold=True), get_docx_run(f"{val}"))
+            for k, val in zip(headers, row)
+        ]
+        paragraphs.append(DOCX_PAGE_BREAK)
+        return "".join(paragraphs).encode("utf-8")
+
+    def stream_rows(self, headers, rows, **kwargs):
+        entries, head, tail = get_docx_template()
+        buffer = ChunkBuffer()
+        with ZipFile(buffer, "w", ZIP_DEFLATED) as package:
+            for name, content in entries:
+                if name != DOCX_DOCUMENT:
+                    package.writestr(name, content)
+                    continue
+                with package.open(name, "w", force_zip64=True) as document:
+                    document.write(head)
+                    for row in rows:
+                        if row:
+                            document.write(self.get_record_xml(headers, row))
+                        if buffer.size >= self.chunk_size:
+                            yield buffer.drain()
+                    document.write(tail)
+        yield buffer.drain()
 
-        for row in formatted:
-            if row:
-                for k, val in row.items():
-                    p = doc.add_paragraph()
-                    p.add_run(f"{k}:").bold = True
-                    p.add_run(f"{val}")
-                doc.add_page_break()
+    def render_dataset(self, data, *args, **kwargs):
+        for chunk in self.stream_rows(data.headers or [], self.budget.iter_rows(iter_dataset_rows(data))):
+            self.output.write(chunk)
 
-        doc.save(stream)
-        return stream.getvalue()
 
-    def render_dataset(self, data, *args, **kwargs):
-        formatted = data._package()
-        with open(self.filename, "wb") as fp:
-            fp.write(self.export_set(formatted))
+class ExportStreamingDocxRenderer(ExportStreamingRenderer, ExportDocxRenderer):
+    """Streams the record per page .docx as it is written"""
+
+    def stream_rows(self, headers, rows, **kwargs):
+        return ExportDocxRenderer.stream_rows(self, headers, rows, **kwargs)
 
 
 class ExportDocxTableRenderer(ExportDocxBaseRenderer):
@@ -313,6 +955,8 @@ class ExportDocxTableRenderer(ExportDocxBaseRenderer):
     format = "docx_table"
 
     def export_set(self, formatted, headers):
+        from docx import Document
+
         stream = BytesIO()
         doc = Document()
 
@@ -326,20 +970,44 @@ class ExportDocxTableRenderer(ExportDocxBaseRenderer):
             for i, heading in enumerate(headers):
                 header_cells[i].text = heading
 
-            # set data
-            for record in formatted:
-                row = table.add_row().cells
-                for i, key in enumerate(record):
-                    row[i].text = str(record[key])
+            self.add_rows(table, formatted)
 
         doc.save(stream)
         return stream.getvalue()
 
+    def add_rows(self, table, formatted):
+        """Append the records to the table xml in a single pass,
+        instead of going through python-docx rows and cells, which looks up
+        the whole table on every access
+        """
+        from docx.oxml.ns import qn
+        from lxml.etree import SubElement
+
+        tbl = table._tbl
+        properties = [tc.tcPr for tc in tbl.tr_lst[0].tc_lst]
+        for record in self.budget.iter_rows(formatted):
+            tr = SubElement(tbl, qn("w:tr"))
+            for value, tcPr in zip(record.values(), properties):
+                tc = SubElement(tr, qn("w:tc"))
+                if tcPr is not None:
+                    tc.append(deepcopy(tcPr))
+                self.add_text(SubElement(SubElement(tc, qn("w:p")), qn("w:r")), str(value))
+
+    def add_text(self, run, text):
+        from docx.oxml.ns import qn
+        from lxml.etree import SubElement
+
+        for tag, part in split_docx_text(text):
+            element = SubElement(run, qn(tag))
+            if part is not None:
+                element.text = part
+                if part != part.strip():
+                    element.set(qn("xml:space"), "preserve")
+
     def render_dataset(self, data, *args, **kwargs):
         formatted = data._package()
         headers = data.headers
-        with open(self.filename, "wb") as fp:
-            fp.write(self.export_set(formatted, headers))
+        self.output.write(self.export_set(formatted, headers))
 
 
 class FriendlyCSVRenderer(CSVRenderer):
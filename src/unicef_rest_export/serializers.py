@@ -1,19 +1,151 @@
-from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
-from rest_framework import serializers
+import re
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework import relations, serializers
 from tablib import Dataset
 
+from unicef_rest_export.metadata import get_serializer_metadata
+from unicef_rest_export.timing import get_export_timer
+
+# control characters that openpyxl refuses in cells (same as its own
+# ILLEGAL_CHARACTERS_RE, without importing openpyxl for every export)
+ILLEGAL_CHARACTERS_RE = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+
+# fields whose representation only depends on the model field value,
+# so they can be read with values_list instead of going through instances
+VALUES_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.DateField,
+    serializers.DateTimeField,
+    serializers.DecimalField,
+    serializers.DurationField,
+    serializers.EmailField,
+    serializers.FloatField,
+    serializers.IntegerField,
+    serializers.IPAddressField,
+    serializers.JSONField,
+    serializers.ReadOnlyField,
+    serializers.SlugField,
+    serializers.TimeField,
+    serializers.URLField,
+    serializers.UUIDField,
+    relations.PrimaryKeyRelatedField,
+)
+
+
+def get_related_lookups(serializer, model, prefix="", many=False):
+    """Walk the fields of a serializer, returning the select_related and
+    prefetch_related lookups that its representation follows from model;
+    dotted sources, nested serializers and many relations included
+    """
+    select_related, prefetch_related = [], []
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        nested_many = isinstance(field, (serializers.ListSerializer, relations.ManyRelatedField))
+        child = getattr(field, "child", None) or getattr(field, "child_relation", None) or field
+        if field.source == "*":
+            if isinstance(child, serializers.Serializer):
+                select, prefetch = get_related_lookups(child, model, prefix, many)
+                select_related += select
+                prefetch_related += prefetch
+            continue
+
+        current, lookup, multiple = model, prefix, many
+        attrs = field.source.split(".")
+        for i, attr in enumerate(attrs):
+            try:
+                model_field = current._meta.get_field(attr)
+            except FieldDoesNotExist:
+                break
+            if not model_field.is_relation or model_field.related_model is None:
+                break
+            if attr == getattr(model_field, "attname", None) != model_field.name:
+                # the foreign key column itself, i.e. author_id
+                break
+            if (
+                i == len(attrs) - 1
+                and not nested_many
+                and model_field.concrete
+                and isinstance(child, relations.RelatedField)
+                and child.use_pk_only_optimization()
+            ):
+                # only the foreign key column is needed
+                break
+            multiple = multiple or model_field.many_to_many or model_field.one_to_many
+            lookup = LOOKUP_SEP.join(filter(None, [lookup, attr]))
+            (prefetch_related if multiple else select_related).append(lookup)
+            current = model_field.related_model
+        else:
+            if isinstance(child, serializers.Serializer):
+                select, prefetch = get_related_lookups(child, current, lookup, multiple)
+                select_related += select
+                prefetch_related += prefetch
+
+    def outermost(lookups):
+        # "a__b" covers "a", keep the longest lookups only
+        return sorted(
+            {lookup for lookup in lookups if not any(other.startswith(lookup + LOOKUP_SEP) for other in lookups)}
+        )
+
+    return outermost(select_related), outermost(prefetch_related)
+
+
+def compile_values_columns(child, model):
+    """Columns of model to read with values_list for each field of the
+    child serializer, with the field's to_representation, or None when
+    any of the fields cannot be read that way
+    """
+    if not isinstance(child, serializers.ModelSerializer):
+        return None
+    if type(child).to_representation is not serializers.Serializer.to_representation:
+        return None
+
+    columns = []
+    for field in child.fields.values():
+        if field.write_only:
+            continue
+        if type(field) not in VALUES_FIELDS or field.source == "*" or "." in field.source:
+            return None
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return None
+        if not model_field.concrete or model_field.many_to_many:
+            return None
+        if isinstance(field, relations.PrimaryKeyRelatedField):
+            # pk only optimization, the column already holds the pk
+            if not model_field.is_relation or field.pk_field or not model_field.target_field.primary_key:
+                return None
+            columns.append((field.field_name, model_field.attname, None))
+        elif model_field.is_relation:
+            return None
+        else:
+            columns.append((field.field_name, model_field.attname, field.to_representation))
+    return columns
+
+
+def iter_dataset_rows(dataset):
+    """Iterate the rows of a dataset, with its formatters applied"""
+    rows = iter(dataset._package(dicts=False))
+    if dataset.headers:
+        next(rows)
+    return rows
+
 
 class ExportSerializer(serializers.ListSerializer):
     """Transforms data into a dataset"""
 
     read_only = True
 
+    def get_metadata(self):
+        return get_serializer_metadata(self.child)
+
     def get_header_label(self, field):
-        try:
-            label = self.child.fields[field].label
-        except KeyError:
-            label = field
-        return label
+        return self.get_metadata().get_label(field)
 
     def get_headers(self, data):
         headers = []
@@ -21,36 +153,83 @@ class ExportSerializer(serializers.ListSerializer):
             headers.append(str(self.get_header_label(field)))
         return headers
 
+    def get_row(self, values):
+        return values
+
     def get_dataset(self, data):
         headers = self.get_headers(data)
-        data_list = []
-        for d in data:
-            data_list.append([v for _, v in d.items()])
-        dataset = Dataset(*data_list, headers=headers)
+        headers, data_list = self.transform_columns(headers, [[v for _, v in d.items()] for d in data])
+        dataset = Dataset(*[self.get_row(row) for row in data_list], headers=headers)
         return dataset
 
+    def transform_columns(self, headers, rows):
+        """Apply the column transforms of the view to a chunk of rows"""
+        view = self.context.get("view", None)
+        pipeline = view.get_column_pipeline(headers) if hasattr(view, "get_column_pipeline") else None
+        if pipeline is None:
+            return headers, rows
+        with get_export_timer(self.context).stage("transform"):
+            return pipeline.headers, pipeline.apply(rows)
+
+    def get_values_columns(self, model):
+        """Compile the child serializer to a list of (field name, column,
+        to_representation) when all its fields can be read with values_list
+        and represented the same way, otherwise return None.
+        Compiled once per child serializer class and model.
+        """
+        for name in ("data", "get_dataset", "get_headers", "to_representation"):
+            if getattr(type(self), name) is not getattr(ExportSerializer, name):
+                return None
+        return self.get_metadata().get(("values_columns", model), lambda child: compile_values_columns(child, model))
+
+    def get_values_rows(self, columns, values):
+        """Represent rows of values_list output the way the child would,
+        get_row is applied once the dataset is built
+        """
+        converters = [to_representation for _, _, to_representation in columns]
+        for row in values:
+            yield [
+                value if value is None or convert is None else convert(value) for value, convert in zip(row, converters)
+            ]
+
+    def get_values_dataset(self, columns, rows):
+        timer = get_export_timer(self.context)
+        with timer.stage("serialize"):
+            data_list = list(rows)
+        if not data_list:
+            return Dataset([])
+        headers = [str(self.get_header_label(name)) for name, _, _ in columns]
+        headers, data_list = self.transform_columns(headers, data_list)
+        with timer.stage("dataset"):
+            dataset = Dataset(*[self.get_row(row) for row in data_list], headers=headers)
+        return self.transform_dataset(dataset)
+
     def transform_dataset(self, dataset):
         view = self.context.get("view", None)
         if view and hasattr(view, "transform_dataset"):
-            return self.context["view"].transform_dataset(dataset)
+            with get_export_timer(self.context).stage("transform"):
+                return self.context["view"].transform_dataset(dataset)
         return dataset
 
+    def to_dataset(self):
+        """Dataset of the serialized data, before the view transforms it"""
+        timer = get_export_timer(self.context)
+        with timer.stage("serialize"):
+            data = super().data
+        if isinstance(data, Dataset) or data:
+            with timer.stage("dataset"):
+                return self.get_dataset(data)
+        return None
+
     @property
     def data(self):
-        data = super().data
-        if isinstance(data, Dataset) or data:
-            dataset = self.get_dataset(data)
+        dataset = self.to_dataset()
+        if dataset is not None:
             return self.transform_dataset(dataset)
         else:
             return Dataset([])
 
 
 class XLSXExportSerializer(ExportSerializer):
-    def get_dataset(self, data):
-        headers = self.get_headers(data)
-        data_list = []
-        for d in data:
-            data_list.append([ILLEGAL_CHARACTERS_RE.sub("", v) if isinstance(v, str) else v for _, v in d.items()])
-
-        dataset = Dataset(*data_list, headers=headers)
-        return dataset
+    def get_row(self, values):
+        return [ILLEGAL_CHARACTERS_RE.sub("", v) if isinstance(v, str) else v for v in values]
@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# sent with view and request arguments, before the queryset is read
+export_started = Signal()
+
+# sent with view, request and timer arguments, once the export is rendered,
+# or for streaming exports, once the last chunk is sent
+export_finished = Signal()
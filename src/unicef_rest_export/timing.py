@@ -0,0 +1,96 @@
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from unicef_rest_export.utils import get_export_attr
+
+EXPORT_TIMING = getattr(settings, "EXPORT_TIMING", True)
+
+
+class ExportTimer:
+    """Time spent in each stage of an export, along with its row count
+    and output size. Time in nested stages (a query run while serializing)
+    counts towards both stages.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.stages = {}
+        self.queries = 0
+        self.rows = None
+        self.size = None
+        self.duration = None
+        self.started = perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + perf_counter() - start
+
+    def execute(self, execute, sql, params, many, context):
+        self.queries += 1
+        with self.stage("db"):
+            return execute(sql, params, many, context)
+
+    def track_queries(self, using=DEFAULT_DB_ALIAS):
+        return connections[using].execute_wrapper(self.execute)
+
+    def count(self, rows):
+        self.rows = 0
+        for row in rows:
+            self.rows += 1
+            yield row
+
+    def add_size(self, content):
+        self.size = (self.size or 0) + len(content)
+
+    def finish(self):
+        self.duration = perf_counter() - self.started
+
+    def get_server_timing(self):
+        metrics = ["{};dur={:.1f}".format(name, seconds * 1000) for name, seconds in self.stages.items()]
+        if self.duration is not None:
+            metrics.append("total;dur={:.1f}".format(self.duration * 1000))
+        for name in ("rows", "size"):
+            if getattr(self, name) is not None:
+                metrics.append('{};desc="{}"'.format(name, getattr(self, name)))
+        return ", ".join(metrics)
+
+    def as_dict(self):
+        return {
+            "stages": {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+            "duration": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "queries": self.queries,
+            "rows": self.rows,
+            "size": self.size,
+        }
+
+
+class NullTimer:
+    """Stands in for ExportTimer when timing is off, doing nothing"""
+
+    enabled = False
+    _stage = nullcontext()
+
+    def stage(self, name):
+        return self._stage
+
+    def track_queries(self, using=DEFAULT_DB_ALIAS):
+        return self._stage
+
+    def count(self, rows):
+        return rows
+
+
+NULL_TIMER = NullTimer()
+
+
+def get_export_timer(context):
+    """Timer of the export the serializer or renderer context belongs to"""
+    return get_export_attr(context, "export_timer", NULL_TIMER)
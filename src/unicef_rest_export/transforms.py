@@ -0,0 +1,61 @@
+def batch_transform(func):
+    """Mark a column transform as taking the values of a whole column,
+    a chunk of rows at a time, and returning as many values
+    """
+    func.batch_transform = True
+    return func
+
+
+class ColumnPipeline:
+    """Column transforms of an export compiled, for its headers, into a
+    single function mapping a chunk of rows. In order, values are
+    transformed, new columns derived (from a dict of the row, by header),
+    columns renamed and dropped.
+    Headers that the export does not have (i.e. left out with ?fields=)
+    are ignored.
+    """
+
+    def __init__(self, headers, transforms=None, renames=None, drops=(), derives=None):
+        index = {header: i for i, header in enumerate(headers)}
+        transforms = [(index[header], func) for header, func in (transforms or {}).items() if header in index]
+        self.row_transforms = [(i, func) for i, func in transforms if not getattr(func, "batch_transform", False)]
+        self.batch_transforms = [(i, func) for i, func in transforms if getattr(func, "batch_transform", False)]
+        self.derives = list((derives or {}).items())
+        self.source_headers = list(headers)
+
+        renames = renames or {}
+        keep = [i for i, header in enumerate(headers) if header not in drops]
+        derived = [i for i, (header, _) in enumerate(self.derives) if header not in drops]
+        self.headers = [renames.get(headers[i], headers[i]) for i in keep]
+        self.headers += [renames.get(self.derives[i][0], self.derives[i][0]) for i in derived]
+        self.map_row = self.compile(keep, derived)
+
+    def compile(self, keep, derived):
+        """The function mapping a row, doing only the work needed"""
+        row_transforms = self.row_transforms
+        derive_funcs = [self.derives[i][1] for i in derived]
+        headers = self.source_headers
+        everything = keep == list(range(len(headers)))
+
+        def map_row(row):
+            # row is a list of its own, see apply
+            for i, func in row_transforms:
+                row[i] = func(row[i])
+            extra = []
+            if derive_funcs:
+                values = dict(zip(headers, row))
+                extra = [func(values) for func in derive_funcs]
+            if not everything:
+                row = [row[i] for i in keep]
+            return row + extra if extra else row
+
+        return map_row
+
+    def apply(self, rows):
+        """Map a chunk of rows, batched transforms a column at a time"""
+        rows = [list(row) for row in rows]
+        for i, func in self.batch_transforms:
+            for row, value in zip(rows, func([row[i] for row in rows])):
+                row[i] = value
+        map_row = self.map_row
+        return [map_row(row) for row in rows]
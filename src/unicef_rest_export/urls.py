@@ -0,0 +1,9 @@
+from django.urls import re_path
+
+from unicef_rest_export.views import ExportJobView
+
+app_name = "unicef_rest_export"
+
+urlpatterns = [
+    re_path(r"^jobs/(?P<pk>[0-9a-f]+)/$", ExportJobView.as_view(), name="job"),
+]
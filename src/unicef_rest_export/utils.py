@@ -0,0 +1,6 @@
+def get_export_attr(context, name, default=None):
+    """Attribute of the export view a serializer or renderer context
+    belongs to, or default outside of one
+    """
+    view = context.get("view") if context else None
+    return getattr(view, name, default)
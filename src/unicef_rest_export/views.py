@@ -1,15 +1,80 @@
+import logging
+import re
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain, islice
+
 from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import prefetch_related_objects, QuerySet
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.query import ModelIterable
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.template.response import SimpleTemplateResponse
+from django.urls import NoReverseMatch, reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import cached_property
+from django.utils.http import http_date, parse_etags
+from django.utils.text import slugify
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView
 from rest_framework.mixins import ListModelMixin
 from rest_framework.response import Response
+from rest_framework.serializers import ListSerializer
 from rest_framework.settings import perform_import
+from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 from tablib import Dataset
 
-from unicef_rest_export.renderers import ExportBaseRenderer, ExportOpenXMLRenderer
-from unicef_rest_export.serializers import ExportSerializer, XLSXExportSerializer
+from unicef_rest_export import jobs
+from unicef_rest_export.budgets import EXPORT_BUDGETS, ExportBudget, ExportTooLarge, ExportTooSlow, NULL_BUDGET
+from unicef_rest_export.cache import (
+    EXPORT_CACHE_TIMEOUT,
+    ExportCache,
+    get_cache_key,
+    get_etag,
+    get_fingerprint,
+    get_modified_field,
+)
+from unicef_rest_export.compression import (
+    compress_chunks,
+    COMPRESS_PARAMS,
+    ENCODINGS,
+    EXPORT_COMPRESSION,
+    get_available_encodings,
+    negotiate_encoding,
+)
+from unicef_rest_export.metadata import EXPORT_METADATA_CACHE, get_serializer_metadata, is_metadata_cached, registry
+from unicef_rest_export.renderers import (
+    ExportBaseRenderer,
+    ExportFileRenderer,
+    ExportOpenXMLRenderer,
+    ExportStreamingOpenXMLRenderer,
+)
+from unicef_rest_export.serializers import (
+    ExportSerializer,
+    get_related_lookups,
+    iter_dataset_rows,
+    XLSXExportSerializer,
+)
+from unicef_rest_export.signals import export_finished, export_started
+from unicef_rest_export.timing import EXPORT_TIMING, ExportTimer, NULL_TIMER
+from unicef_rest_export.transforms import ColumnPipeline
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_TEMPLATE = False
+EXPORT_CHUNK_SIZE = getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+EXPORT_DATABOOK_WORKERS = getattr(settings, "EXPORT_DATABOOK_WORKERS", 4)
 EXPORT_RENDERERS = getattr(settings, "EXPORT_RENDERERS", None)
 if EXPORT_RENDERERS is None:
     EXPORT_RENDERERS = (
@@ -26,22 +91,82 @@ if EXPORT_RENDERERS is None:
         DEFAULT_TEMPLATE = True
         EXPORT_RENDERERS = ("unicef_rest_export.renderers.ExportHTMLRenderer",) + EXPORT_RENDERERS
 
-EXPORT_RENDERERS = perform_import(EXPORT_RENDERERS, "EXPORT_RENDERERS")
+
+class LazyRenderers(Sequence):
+    """Renderer classes of a setting, imported on first use rather than
+    along with this module, so projects only load what they render with
+    """
+
+    def __init__(self, paths, setting_name):
+        self.paths = list(paths)
+        self.setting_name = setting_name
+
+    @cached_property
+    def classes(self):
+        return perform_import(self.paths, self.setting_name)
+
+    def __getitem__(self, index):
+        return self.classes[index]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return "<LazyRenderers {!r}>".format(self.paths)
+
+
+EXPORT_RENDERERS = LazyRenderers(EXPORT_RENDERERS, "EXPORT_RENDERERS")
 
 
 class ExportMixin:
     export_serializer_class = ExportSerializer
+    export_chunk_size = EXPORT_CHUNK_SIZE
+    export_async_param = "async"
+    export_cache_timeout = EXPORT_CACHE_TIMEOUT
+    export_cache_modified_fields = ("modified",)
+    export_values = True
+    export_related = True
+    export_keyset = None
+    export_fields_param = "fields"
+    export_exclude_param = "exclude"
+    export_timing = EXPORT_TIMING
+    export_timer = NULL_TIMER
+    export_budgets = EXPORT_BUDGETS
+    export_budget = NULL_BUDGET
+    export_compression = EXPORT_COMPRESSION
+    export_compress_param = "compress"
+    export_encoding = None
+    export_headers = None
+    export_metadata_cache = EXPORT_METADATA_CACHE
+    # header: function of the value, or of a whole column with batch_transform
+    column_transforms = {}
+    # header: new header
+    column_renames = {}
+    column_drops = ()
+    # new header: function of the row, as a dict by header
+    column_derives = {}
 
     def with_list_serializer(self, cls, export_serializer_class=None):
         meta = getattr(cls, "Meta", object)
         if getattr(meta, "list_serializer_class", None):
             return cls
+        export_serializer_class = export_serializer_class or self.export_serializer_class
+
+        def create():
+            class SerializerWithListSerializer(cls):
+                class Meta(meta):
+                    list_serializer_class = export_serializer_class
 
-        class SerializerWithListSerializer(cls):
-            class Meta(meta):
-                list_serializer_class = export_serializer_class or self.export_serializer_class
+            return SerializerWithListSerializer
 
-        return SerializerWithListSerializer
+        # one class per pair, so metadata cached by serializer class is reused
+        return registry.get(("list_serializer", cls, export_serializer_class), create)
 
     def get_serializer_class(self):
         # c.f rest_framework.generics.GenericAPIView
@@ -59,23 +184,612 @@ class ExportMixin:
         else:
             return self.serializer_class
 
+    def get_export_field_names(self, fields):
+        """Names of the fields to export, in the order of the fields
+        query parameter and without those in exclude, or None for all
+        """
+        params = self.request.query_params
+        requested = [name.strip() for name in params.get(self.export_fields_param, "").split(",") if name.strip()]
+        excluded = [name.strip() for name in params.get(self.export_exclude_param, "").split(",") if name.strip()]
+        if not requested and not excluded:
+            return None
+
+        unknown = [name for name in requested + excluded if name not in fields]
+        if unknown:
+            raise ValidationError({self.export_fields_param: "Unknown fields: {}".format(", ".join(unknown))})
+        return [name for name in requested or list(fields) if name not in excluded]
+
+    def is_export_trimmed(self):
+        params = self.request.query_params
+        return isinstance(self.request.accepted_renderer, ExportBaseRenderer) and bool(
+            params.get(self.export_fields_param) or params.get(self.export_exclude_param)
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if self.is_export_trimmed():
+            target = serializer.child if isinstance(serializer, ListSerializer) else serializer
+            fields = target.fields
+            names = self.get_export_field_names(fields)
+            trimmed = [(name, fields[name]) for name in names]
+            fields.fields.clear()
+            fields.fields.update(trimmed)
+            target.export_field_names = tuple(names)
+        return serializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if isinstance(queryset, QuerySet) and queryset._iterable_class is ModelIterable:
+            if self.is_export_trimmed():
+                queryset = self.trim_queryset(queryset)
+            if self.export_related:
+                queryset = self.add_related_lookups(queryset)
+        return queryset
+
+    def trim_queryset(self, queryset):
+        """Leave out the prefetches and columns that none of the exported
+        fields use. Nothing is left out when a field may use anything on
+        the instance, like a SerializerMethodField, or when the queryset
+        is combined (union and similar), as it cannot be changed then
+        """
+        if queryset.query.combinator:
+            return queryset
+        fields = [field for field in self.get_serializer().fields.values() if not field.write_only]
+        roots = {field.source.split(".")[0] for field in fields}
+        if "*" in roots:
+            return queryset
+
+        lookups = [
+            lookup
+            for lookup in queryset._prefetch_related_lookups
+            if getattr(lookup, "prefetch_to", lookup).split(LOOKUP_SEP)[0] in roots
+        ]
+        queryset = queryset.prefetch_related(None).prefetch_related(*lookups)
+
+        opts = queryset.model._meta
+        if all(root in {field.name for field in opts.get_fields()} for root in roots):
+            select_related = queryset.query.select_related
+            deferred = [
+                field.name
+                for field in opts.concrete_fields
+                if not field.primary_key
+                and field.name not in roots
+                and not (field.is_relation and (select_related is True or field.name in (select_related or {})))
+            ]
+            if deferred:
+                queryset = queryset.defer(*deferred)
+        return queryset
+
+    def add_related_lookups(self, queryset):
+        """Add the select_related and prefetch_related lookups that the
+        serializer needs and the queryset does not have yet.
+        Combined querysets (union and similar) cannot take any
+        """
+        if queryset.query.combinator:
+            return queryset
+        select_related, prefetch_related = get_serializer_metadata(self.get_serializer()).get(
+            ("related_lookups", queryset.model), lambda serializer: get_related_lookups(serializer, queryset.model)
+        )
+        if queryset.query.select_related is True:
+            # already following every foreign key
+            select_related = []
+        names, defer = queryset.query.deferred_loading
+        if names:
+            # deferred fields cannot be followed with select_related
+            roots = {name.split(LOOKUP_SEP)[0] for name in names}
+            select_related = [lookup for lookup in select_related if (lookup.split(LOOKUP_SEP)[0] in roots) != defer]
+        existing = {getattr(lookup, "prefetch_to", lookup) for lookup in queryset._prefetch_related_lookups}
+        prefetch_related = [lookup for lookup in prefetch_related if lookup not in existing]
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        logger.debug(
+            "%s added select_related %s and prefetch_related %s",
+            self.__class__.__name__,
+            select_related,
+            prefetch_related,
+        )
+        return queryset
+
+    def get_column_pipeline(self, headers):
+        """The column transforms compiled for these headers, once per export.
+        Functions may be given as the name of a method of the view.
+        """
+        if not (self.column_transforms or self.column_renames or self.column_drops or self.column_derives):
+            return None
+        pipelines = self.__dict__.setdefault("column_pipelines", {})
+        key = tuple(headers)
+        if key not in pipelines:
+
+            def resolve(funcs):
+                return {
+                    header: getattr(self, func) if isinstance(func, str) else func for header, func in funcs.items()
+                }
+
+            pipelines[key] = ColumnPipeline(
+                headers,
+                transforms=resolve(self.column_transforms),
+                renames=self.column_renames,
+                drops=self.column_drops,
+                derives=resolve(self.column_derives),
+            )
+        return pipelines[key]
+
+    def transform_rows(self, rows):
+        """Generator stage between serialization and rendering, which may
+        filter, expand or rewrite rows; the headers are in export_headers.
+        Calls transform_row on each row by default, leaving out the rows
+        it returns None for.
+        """
+        for row in rows:
+            row = self.transform_row(row)
+            if row is not None:
+                yield row
+
+    def transform_row(self, row):
+        return row
+
+    def has_row_transforms(self):
+        view_class = type(self)
+        return (
+            view_class.transform_rows is not ExportMixin.transform_rows
+            or view_class.transform_row is not ExportMixin.transform_row
+        )
+
     def get_data(self, serializer):
         data = serializer.data
         if isinstance(self.request.accepted_renderer, ExportBaseRenderer):
-            headers = []
-            for field in data.keys():
-                try:
-                    label = serializer.fields[field].label
-                except KeyError:
-                    label = field
-                headers.append(label)
-            dataset = Dataset(*[[v for _, v in data.items()]], headers=headers)
+            metadata = get_serializer_metadata(serializer)
+            headers = [metadata.get_label(field) for field in data.keys()]
+            rows = [[v for _, v in data.items()]]
+            pipeline = self.get_column_pipeline([str(header) for header in headers])
+            if pipeline is not None:
+                headers, rows = pipeline.headers, pipeline.apply(rows)
+            if self.has_row_transforms():
+                self.export_headers = headers
+                rows = list(self.transform_rows(iter(rows)))
+            dataset = Dataset(*rows, headers=headers)
             if hasattr(self, "transform_dataset"):
                 data = self.transform_dataset(dataset)
             else:
                 data = dataset
         return data
 
+    def use_keyset_pagination(self, queryset):
+        """Whether to read the queryset by pages rather than with a
+        server side cursor, which not every database (or pooler) allows
+        """
+        if self.export_keyset is not None:
+            return self.export_keyset
+        connection = connections[queryset.db]
+        return not connection.features.can_use_chunked_reads or connection.settings_dict.get(
+            "DISABLE_SERVER_SIDE_CURSORS", False
+        )
+
+    def iter_queryset_pages(self, queryset):
+        """Read the queryset a page at a time; by pk when it is ordered by pk
+        (or not at all), falling back to offsets for any other ordering
+        and for sliced querysets, which cannot be filtered or reordered
+        """
+        size = self.export_chunk_size
+        query = queryset.query
+        ordering = list(query.order_by) or (list(queryset.model._meta.ordering) if query.default_ordering else [])
+        pk_name = queryset.model._meta.pk.name
+        if query.can_filter() and ordering in ([], ["pk"], [pk_name], ["-pk"], ["-" + pk_name]):
+            descending = bool(ordering) and ordering[0].startswith("-")
+            order = "-pk" if descending else "pk"
+            pks = queryset.order_by(order).values_list("pk", flat=True)
+            last = None
+            while True:
+                if last is None:
+                    page = list(pks[:size])
+                elif descending:
+                    page = list(pks.filter(pk__lt=last)[:size])
+                else:
+                    page = list(pks.filter(pk__gt=last)[:size])
+                if not page:
+                    return
+                yield from queryset.filter(pk__in=page).order_by(order)
+                last = page[-1]
+        else:
+            start = 0
+            while True:
+                end = start + size
+                page = list(queryset[start:end])
+                yield from page
+                if len(page) < size:
+                    return
+                start = end
+
+    def iter_queryset(self, queryset):
+        """Iterate the queryset without loading all of it at once"""
+        if self.use_keyset_pagination(queryset):
+            rows = self.iter_queryset_pages(queryset)
+        else:
+            rows = queryset.iterator(chunk_size=self.export_chunk_size)
+        return self.export_budget.iter_rows(rows)
+
+    def iter_export_chunks(self, queryset):
+        """Yield the queryset as lists of at most export_chunk_size
+        instances, running its prefetch lookups chunk by chunk
+        """
+        size = self.export_chunk_size
+        if not isinstance(queryset, QuerySet):
+            for start in range(0, len(queryset), size):
+                end = start + size
+                yield queryset[start:end]
+            return
+        if queryset.query.combinator:
+            # combined querysets take no prefetch lookups, nor paging by pk
+            instances = self.export_budget.iter_rows(iter(queryset))
+            while True:
+                chunk = list(islice(instances, size))
+                if not chunk:
+                    return
+                yield chunk
+
+        lookups = queryset._prefetch_related_lookups
+        chunk = []
+        for instance in self.iter_queryset(queryset.prefetch_related(None)):
+            chunk.append(instance)
+            if len(chunk) == size:
+                prefetch_related_objects(chunk, *lookups)
+                yield chunk
+                chunk = []
+        if chunk:
+            prefetch_related_objects(chunk, *lookups)
+            yield chunk
+
+    def get_export_values_columns(self, serializer, queryset):
+        if not self.export_values or not isinstance(queryset, QuerySet) or not isinstance(serializer, ExportSerializer):
+            return None
+        query = queryset.query
+        if query.distinct or query.distinct_fields or query.combinator or query.extra_select:
+            # projecting only the exported columns would change what the rows are
+            return None
+        return serializer.get_values_columns(queryset.model)
+
+    def iter_export_values(self, serializer, queryset, columns):
+        values = queryset.prefetch_related(None).values_list(*[column for _, column, _ in columns])
+        return serializer.get_values_rows(columns, self.iter_queryset(values))
+
+    def get_export_data(self, queryset):
+        """Serialize the queryset into a dataset, straight from values_list
+        rows when the serializer allows it, otherwise a chunk at a time
+        """
+        serializer = self.get_serializer(queryset, many=True)
+        chunked = isinstance(serializer, ExportSerializer) and type(serializer).data is ExportSerializer.data
+        if chunked and self.has_row_transforms():
+            # the rows go through transform_rows the way they are streamed
+            headers, rows = self.get_export_rows(queryset)
+            data_list = list(rows)
+            if not data_list:
+                return Dataset([])
+            with self.export_timer.stage("dataset"):
+                return Dataset(*data_list, headers=headers)
+
+        columns = self.get_export_values_columns(serializer, queryset)
+        if columns is not None:
+            return serializer.get_values_dataset(columns, self.iter_export_values(serializer, queryset, columns))
+        if not chunked:
+            return serializer.data
+
+        # serialize chunk by chunk, so only a chunk of instances is in memory,
+        # and transform the dataset once all the rows are in
+        headers = None
+        data_list = []
+        for chunk in self.iter_export_chunks(queryset):
+            dataset = self.get_serializer(chunk, many=True).to_dataset()
+            headers = dataset.headers
+            data_list.extend(iter_dataset_rows(dataset))
+        if not data_list:
+            return Dataset([])
+        with self.export_timer.stage("dataset"):
+            dataset = Dataset(*data_list, headers=headers)
+        return serializer.transform_dataset(dataset)
+
+    def iter_export_datasets(self, queryset):
+        serializer = self.get_serializer(queryset, many=True)
+        columns = self.get_export_values_columns(serializer, queryset)
+        if columns is not None:
+            rows = self.iter_export_values(serializer, queryset, columns)
+            while True:
+                chunk = list(islice(rows, self.export_chunk_size))
+                if not chunk:
+                    return
+                yield serializer.get_values_dataset(columns, chunk)
+
+        for chunk in self.iter_export_chunks(queryset):
+            yield self.get_serializer(chunk, many=True).data
+
+    def get_export_rows(self, queryset):
+        """Return the headers and a lazy iterator over the rows of the export.
+        The first chunk is serialized straight away to get the headers,
+        the remaining ones only as the rows are consumed.
+        Note that transform_dataset is applied to each chunk separately,
+        before the rows go through transform_rows.
+        """
+        datasets = self.iter_export_datasets(queryset)
+        first = next(datasets, None)
+        if first is None:
+            return [], iter([])
+        headers = first.headers or []
+        rows = chain.from_iterable(iter_dataset_rows(dataset) for dataset in chain([first], datasets))
+        if self.has_row_transforms():
+            self.export_headers = headers
+            rows = self.transform_rows(rows)
+        return headers, self.export_timer.count(rows)
+
+    def stream_export(self, queryset):
+        renderer = self.request.accepted_renderer
+        headers, rows = self.get_export_rows(queryset)
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = "{}; charset={}".format(content_type, renderer.charset)
+        chunks = renderer.render_stream(headers, rows, self.get_renderer_context())
+        if self.export_budget.enabled:
+            chunks = self.iter_budget_stream(chunks)
+        if self.export_encoding:
+            chunks = compress_chunks(chunks, self.export_encoding, renderer.charset or "utf-8")
+        if self.export_timer.enabled:
+            chunks = self.iter_timed_stream(chunks, getattr(queryset, "db", DEFAULT_DB_ALIAS))
+        return StreamingHttpResponse(chunks, content_type=content_type)
+
+    def iter_budget_stream(self, chunks):
+        """Check the size and time budget chunk by chunk. The status is sent
+        by then, going over budget aborts the response instead
+        """
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            self.export_budget.check_size(size)
+            self.export_budget.check_time()
+            yield chunk
+
+    def iter_timed_stream(self, chunks, using):
+        """Time the rendering of each chunk, leaving out the time
+        spent waiting on the client, and finish the export with the stream
+        """
+        timer = self.export_timer
+        chunks = iter(chunks)
+        try:
+            with timer.track_queries(using):
+                while True:
+                    with timer.stage("stream"):
+                        chunk = next(chunks, None)
+                    if chunk is None:
+                        return
+                    timer.add_size(chunk)
+                    yield chunk
+        finally:
+            self.finish_export()
+
+    def is_async_export(self):
+        return isinstance(self.request.accepted_renderer, ExportBaseRenderer) and self.request.query_params.get(
+            self.export_async_param
+        ) in ("1", "true")
+
+    def start_export_job(self):
+        """Queue the export to run in the background, answering
+        with the job id and where to poll for its result
+        """
+        params = self.request.query_params.copy()
+        params.pop(self.export_async_param)
+        job_id = jobs.start_export_job(self.request, dict(params.lists()))
+        data = {"id": job_id, "status": jobs.PENDING}
+        try:
+            data["url"] = self.request.build_absolute_uri(reverse("unicef_rest_export:job", args=[job_id]))
+        except NoReverseMatch:
+            pass
+        return JsonResponse(data, status=status.HTTP_202_ACCEPTED)
+
+    def get_export_cache_scope(self):
+        """What the user is allowed to see, as part of the cache key.
+        Defaults to the user, override to share exports between users
+        """
+        user = self.request.user
+        return user.pk if user.is_authenticated else None
+
+    def get_export_fingerprint(self, queryset):
+        """Summary of the exported data that changes along with it, or None
+        when there is no telling, which leaves the export uncached.
+        Covers the rows of the queryset when its model has one of
+        export_cache_modified_fields, override to cover related data too
+        """
+        if not isinstance(queryset, QuerySet):
+            return None
+        modified_field = get_modified_field(queryset.model, self.export_cache_modified_fields)
+        if modified_field is None:
+            return None
+        return get_fingerprint(queryset, modified_field)
+
+    def get_export_cache_key(self, fingerprint):
+        return get_cache_key(
+            "{}.{}".format(self.__class__.__module__, self.__class__.__qualname__),
+            sorted(self.kwargs.items()),
+            sorted((param, sorted(values)) for param, values in self.request.query_params.lists()),
+            self.request.accepted_renderer.format,
+            self.export_encoding,
+            self.get_export_cache_scope(),
+            fingerprint,
+        )
+
+    def get_cached_export(self, queryset):
+        """Answer with a 304 or the cached export when possible, otherwise
+        keep the key for finalize_response to cache the rendered export.
+        The ETag is that of the cached content, so 304s end with the entry
+        """
+        fingerprint = self.get_export_fingerprint(queryset)
+        if fingerprint is None:
+            return None
+        self.export_cache_headers = {}
+        modified = fingerprint.get("modified") if isinstance(fingerprint, dict) else None
+        if modified:
+            self.export_cache_headers["Last-Modified"] = http_date(modified.timestamp())
+
+        key = self.get_export_cache_key(fingerprint)
+        cached = ExportCache().get(key)
+        if cached is None:
+            self.export_cache_key = key
+            return None
+        content_type, content = cached
+        self.export_cache_headers["ETag"] = get_etag(content)
+        etags = parse_etags(self.request.META.get("HTTP_IF_NONE_MATCH", ""))
+        if self.export_cache_headers["ETag"] in etags or "*" in etags:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+        for header, value in self.export_cache_headers.items():
+            response[header] = value
+        return response
+
+    def get_export_encoding(self):
+        """Compression of text exports; the one asked for with the compress
+        parameter, as a file download, otherwise the preferred one of the
+        Accept-Encoding header, as a content encoding
+        """
+        renderer = self.request.accepted_renderer
+        if not self.export_compression or not getattr(renderer, "compressible", False):
+            return None
+        requested = self.request.query_params.get(self.export_compress_param)
+        if requested:
+            encoding = COMPRESS_PARAMS.get(requested)
+            if encoding not in get_available_encodings():
+                raise ValidationError({self.export_compress_param: "Unsupported compression: {}".format(requested)})
+            return encoding
+        return negotiate_encoding(self.request.META.get("HTTP_ACCEPT_ENCODING", ""))
+
+    def set_export_encoding_headers(self, response):
+        renderer = self.request.accepted_renderer
+        if self.request.query_params.get(self.export_compress_param):
+            suffix, content_type = ENCODINGS[self.export_encoding]
+            filename = "{}.{}{}".format(slugify(self.get_view_name()) or "export", renderer.format, suffix)
+            if isinstance(response, Response):
+                # rendering sets the header from content_type
+                response.content_type = content_type
+            response["Content-Type"] = content_type
+            response["Content-Disposition"] = 'attachment; filename="{}"'.format(filename)
+        else:
+            response["Content-Encoding"] = self.export_encoding
+            patch_vary_headers(response, ("Accept-Encoding",))
+
+    def get_export_budget(self):
+        """Limits of the accepted format in export_budgets, or the default ones"""
+        renderer = self.request.accepted_renderer
+        limits = self.export_budgets.get(renderer.format, self.export_budgets.get("default"))
+        if not limits:
+            return NULL_BUDGET
+        alternatives = [
+            cls.format
+            for cls in self.renderer_classes
+            if getattr(cls, "streaming", False) and cls.format != renderer.format
+        ]
+        return ExportBudget(renderer.format, alternatives=alternatives, **limits)
+
+    def check_export_rows(self, queryset):
+        """Refuse exports over the row budget before serializing anything,
+        counting no further than one row past it
+        """
+        limit = self.export_budget.rows
+        if isinstance(queryset, QuerySet):
+            self.export_budget.check_rows(queryset[: limit + 1].count())
+        else:
+            self.export_budget.check_rows(len(queryset))
+
+    def start_export(self):
+        """Start timing the export, unless export_timing is off"""
+        if self.export_timing:
+            self.export_timer = ExportTimer()
+            export_started.send(sender=self.__class__, view=self, request=self.request)
+
+    def finish_export(self, response=None):
+        """Report the export timings, as a Server-Timing header on the
+        response (when it is not already sent), a signal and a log record
+        """
+        timer = self.export_timer
+        timer.finish()
+        if response is not None:
+            response["Server-Timing"] = timer.get_server_timing()
+        export_finished.send(sender=self.__class__, view=self, request=self.request, timer=timer)
+        logger.info(
+            "%s %s export of %s rows took %.1fms",
+            self.__class__.__name__,
+            self.request.accepted_renderer.format,
+            timer.rows,
+            timer.duration * 1000,
+            extra={
+                "export": dict(
+                    timer.as_dict(),
+                    view="{}.{}".format(self.__class__.__module__, self.__class__.__qualname__),
+                    format=self.request.accepted_renderer.format,
+                )
+            },
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not isinstance(request.accepted_renderer, ExportBaseRenderer) or self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+        if self.is_async_export():
+            return self.start_export_job()
+
+        self.start_export()
+        self.export_budget = self.get_export_budget()
+        self.export_encoding = self.get_export_encoding()
+        queryset = self.filter_queryset(self.get_queryset())
+        with self.export_timer.track_queries(getattr(queryset, "db", DEFAULT_DB_ALIAS)):
+            if self.export_budget.enabled and self.export_budget.rows is not None:
+                self.check_export_rows(queryset)
+            if self.export_cache_timeout is not None and isinstance(queryset, QuerySet):
+                response = self.get_cached_export(queryset)
+                if response is not None:
+                    return response
+            if getattr(request.accepted_renderer, "streaming", False):
+                return self.stream_export(queryset)
+            return Response(self.get_export_data(queryset))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        cache_key = getattr(self, "export_cache_key", None)
+        if isinstance(response, Response) and (
+            cache_key
+            or self.export_budget.enabled
+            or isinstance(getattr(response, "accepted_renderer", None), ExportFileRenderer)
+        ):
+            # file renderers hand back large output as a file,
+            # stream it rather than reading it into the response
+            try:
+                content = response.rendered_content
+            except (ExportTooLarge, ExportTooSlow) as exc:
+                # over budget while rendering, answer with the error instead
+                self.export_cache_key = None
+                return self.finalize_response(request, self.handle_exception(exc), *args, **kwargs)
+            if isinstance(content, bytes):
+                response.content = content
+                if cache_key and status.is_success(response.status_code):
+                    if ExportCache().set(cache_key, response["Content-Type"], content, self.export_cache_timeout):
+                        self.export_cache_headers["ETag"] = get_etag(content)
+            else:
+                file_response = FileResponse(content, status=response.status_code)
+                for header, value in response.items():
+                    file_response[header] = value
+                response = file_response
+        if cache_key and status.is_success(response.status_code):
+            for header, value in self.export_cache_headers.items():
+                response[header] = value
+        if self.export_encoding and status.is_success(response.status_code):
+            self.set_export_encoding_headers(response)
+        if self.export_timer.enabled:
+            if isinstance(response, StreamingHttpResponse) and not isinstance(response, FileResponse):
+                # timings so far, the export finishes along with the stream
+                response["Server-Timing"] = self.export_timer.get_server_timing()
+            elif isinstance(response, SimpleTemplateResponse) and not response.is_rendered:
+                response.add_post_render_callback(self.finish_export)
+            else:
+                self.finish_export(response)
+        return response
+
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(instance)
@@ -119,12 +833,133 @@ class ExportModelView(ListAPIView):
                 labels[f] = f.replace("_", " ").title()
         return labels
 
+    def get_labels(self, serializer_class):
+        serializer = serializer_class()
+        serializer_fields = serializer.get_fields()
+        model = getattr(serializer.Meta, "model")
+        return self.set_labels(serializer_fields, model)
+
     def get_renderer_context(self):
         context = super().get_renderer_context()
         if hasattr(self, "get_serializer_class"):
             serializer_class = self.get_serializer_class()
-            serializer = serializer_class()
-            serializer_fields = serializer.get_fields()
-            model = getattr(serializer.Meta, "model")
-            context["labels"] = self.set_labels(serializer_fields, model)
+            if is_metadata_cached(self):
+                labels = registry.get(
+                    ("labels", type(self), serializer_class), lambda: self.get_labels(serializer_class)
+                )
+            else:
+                labels = self.get_labels(serializer_class)
+            context["labels"] = dict(labels)
         return context
+
+
+@lru_cache(maxsize=None)
+def get_databook_executor(workers):
+    """Thread pool querying the sheets of databooks, started on first use"""
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="databook")
+
+
+class DatabookExportView(APIView):
+    """Several export views as the sheets of one Excel (.xlsx) workbook.
+    export_views lists the view classes, or (view class, initkwargs) pairs
+    the way as_view takes them, i.e. to give a view another queryset.
+    Every sheet is queried and serialized in a thread pool, each thread
+    with its own database connection, and all of them are ready before
+    the response starts, so errors get a proper response; the sheets are
+    held in memory until written to the workbook.
+    """
+
+    export_views = ()
+    databook_workers = EXPORT_DATABOOK_WORKERS
+    renderer_classes = (ExportStreamingOpenXMLRenderer,)
+    invalid_title_re = re.compile(r"[\\*?:/\[\]]")
+
+    def get_export_views(self):
+        """Instances of the export views, for this request,
+        once their permissions are checked
+        """
+        views = []
+        for view_class in self.export_views:
+            initkwargs = {}
+            if isinstance(view_class, (list, tuple)):
+                view_class, initkwargs = view_class
+            view = view_class(**initkwargs)
+            view.args = ()
+            view.kwargs = {}
+            view.format_kwarg = None
+            view.request = self.request
+            view.headers = {}
+            view.check_permissions(self.request)
+            views.append(view)
+        return views
+
+    def get_sheet_title(self, view, titles):
+        """Name of the view, as a unique and valid sheet title"""
+        base = self.invalid_title_re.sub("", str(view.get_view_name())).strip() or "Sheet"
+        title = base[:31]
+        count = 1
+        while title.lower() in titles:
+            count += 1
+            suffix = " ({})".format(count)
+            limit = 31 - len(suffix)
+            title = base[:limit] + suffix
+        titles.add(title.lower())
+        return title
+
+    def get_sheet_rows(self, view):
+        """Headers and rows of a view, run in the thread pool"""
+        try:
+            queryset = view.filter_queryset(view.get_queryset())
+            headers, rows = view.get_export_rows(queryset)
+            return headers, list(rows)
+        finally:
+            # the connections of this thread
+            connections.close_all()
+
+    def get_sheets(self, views):
+        """Headers and rows of every view, queried concurrently"""
+        executor = get_databook_executor(self.databook_workers)
+        futures = [executor.submit(self.get_sheet_rows, view) for view in views]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def stream_databook(self, views, sheets):
+        renderer = self.request.accepted_renderer
+        workbook = renderer.get_workbook()
+        titles = set()
+        for view, (headers, rows) in zip(views, sheets):
+            renderer.write_sheet(workbook, self.get_sheet_title(view, titles), headers, iter(rows))
+        yield from renderer.stream_workbook(workbook)
+
+    def get(self, request, *args, **kwargs):
+        views = self.get_export_views()
+        sheets = self.get_sheets(views)
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(self.stream_databook(views, sheets), content_type=renderer.media_type)
+        filename = "{}.{}".format(slugify(self.get_view_name()) or "export", renderer.format)
+        response["Content-Disposition"] = 'attachment; filename="{}"'.format(filename)
+        return response
+
+
+class ExportJobView(APIView):
+    """Status of a background export job, or its result once done"""
+
+    def get(self, request, pk):
+        store = jobs.get_job_store()
+        try:
+            job = store.get(pk)
+        except ValueError:
+            job = None
+        if job is None or job["user"] != jobs.get_job_owner(request):
+            raise Http404
+
+        if job["status"] == jobs.DONE:
+            return FileResponse(store.open_result(pk), content_type=job["content_type"])
+        data = {"id": job["id"], "status": job["status"]}
+        if job["status"] == jobs.FAILED:
+            data["error"] = job.get("error")
+            return Response(data)
+        return Response(data, status=status.HTTP_202_ACCEPTED)
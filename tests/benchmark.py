@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+"""Time and measure every stage of an export, for each renderer.
+
+Books are generated with the demo factories, in a test database,
+and exported through an ExportView the way a request is, so the values_list,
+chunked, trimmed and streaming paths the view picks are the ones measured.
+Time and peak memory are taken for the response (the view answering) and
+its content (rendered or streamed), along with the time of each stage
+the view's ExportTimer reports;
+
+    python tests/benchmark.py --rows 1000,10000 --output baseline.json
+    python tests/benchmark.py --rows 1000,10000 --compare baseline.json
+
+Compare mode exits with status 1 when the time or peak memory of a stage
+grows more than --threshold over the baseline.
+
+With --imports, the import of unicef_rest_export.views is measured instead,
+in fresh interpreters, along with the renderer backends it loads;
+
+    python tests/benchmark.py --imports
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = ("response", "content")
+# stages of the view's ExportTimer, time only
+TIMER_STAGES = ("db", "serialize", "dataset", "transform", "render", "stream")
+BACKENDS = ("docx", "lxml", "openpyxl", "pypdf", "reportlab")
+
+IMPORT_SCRIPT = """
+import json, resource, sys, time
+sys.path[:0] = {paths!r}
+import django
+django.setup()
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    "time": seconds,
+    "memory": (after - before) * (1 if sys.platform == "darwin" else 1024),
+    "backends": [name for name in {backends!r} if name in sys.modules],
+}}))
+"""
+
+
+class Timings(dict):
+    def __call__(self, stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self[stage] = time.perf_counter() - start
+        return result
+
+
+class PeakMemory(dict):
+    """Memory allocated by each stage at its peak, in bytes"""
+
+    def __call__(self, stage, func, *args):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        result = func(*args)
+        self[stage] = tracemalloc.get_traced_memory()[1] - current
+        return result
+
+
+PATHS = (ROOT, os.path.join(ROOT, "src"), os.path.join(ROOT, "tests", "demoproject"))
+
+
+def setup_django():
+    for path in PATHS:
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "demo.settings")
+
+    import django
+
+    django.setup()
+
+
+def create_books(count):
+    """Top up the books, each author having about ten of them"""
+    import factory
+
+    from tests.factories import AuthorFactory, BookFactory
+
+    from demo.sample.models import Author, Book
+
+    missing = count - Book.objects.count()
+    if missing <= 0:
+        return
+    authors = Author.objects.bulk_create(AuthorFactory.build_batch(max(1, missing // 10)))
+    Book.objects.bulk_create(
+        BookFactory.build_batch(missing, author=factory.Iterator(authors)),
+        batch_size=1000,
+    )
+
+
+def get_view_class(width):
+    """Export view of the books, with width extra text columns"""
+    from rest_framework import serializers
+
+    from unicef_rest_export.views import ExportView
+
+    from demo.sample.models import Book
+
+    extra = {
+        "extra_{}".format(i): serializers.CharField(source="description" if i % 2 else "name") for i in range(width)
+    }
+    meta = type("Meta", (), {"model": Book, "fields": ["id", "author", "name", "description", "best_seller"]})
+    meta.fields += list(extra)
+    serializer_class = type("BenchmarkSerializer", (serializers.ModelSerializer,), dict(extra, Meta=meta))
+    return type("BenchmarkView", (ExportView,), {"queryset": Book.objects.all(), "serializer_class": serializer_class})
+
+
+def get_renderer_classes():
+    """(name, renderer class) of EXPORT_RENDERERS and the streaming renderers,
+    named after their format, with -stream when the format is taken
+    """
+    from unicef_rest_export import renderers
+    from unicef_rest_export.views import EXPORT_RENDERERS
+
+    streaming = [
+        renderers.ExportStreamingCSVRenderer,
+        renderers.ExportStreamingJSONRenderer,
+        renderers.ExportNDJSONRenderer,
+        renderers.ExportStreamingOpenXMLRenderer,
+        renderers.ExportStreamingDocxRenderer,
+    ]
+    classes = [(renderer_class.format, renderer_class) for renderer_class in EXPORT_RENDERERS]
+    taken = {name for name, _ in classes}
+    for renderer_class in streaming:
+        name = renderer_class.format
+        classes.append(("{}-stream".format(name) if name in taken else name, renderer_class))
+    return classes
+
+
+def read_content(response):
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    else:
+        if hasattr(response, "render"):
+            response.render()
+        response.content
+    response.close()
+
+
+def run_stages(view, renderer_class, measure):
+    """Export through the view, as a request would, keeping the
+    stages of its ExportTimer
+    """
+    from rest_framework.test import APIRequestFactory
+
+    from unicef_rest_export.signals import export_finished
+
+    timings = {}
+
+    def finished(sender, timer, **kwargs):
+        timings.update(timer.stages)
+
+    export_finished.connect(finished)
+    try:
+        request = APIRequestFactory().get("/", {"format": renderer_class.format})
+        response = measure("response", view, request)
+        assert response.status_code == 200, response.status_code
+        measure("content", read_content, response)
+    finally:
+        export_finished.disconnect(finished)
+    return timings
+
+
+def run_benchmark(sizes, width=0, formats=None, repeat=1, memory=True):
+    """Return {format: {rows: {stage: {"time": seconds, "memory": bytes}}}},
+    keeping the best time over repeat runs. The books are topped up to
+    each size in turn, so sizes are run from the smallest.
+    """
+    view_class = get_view_class(width)
+    results = {}
+    for rows in sorted(sizes):
+        create_books(rows)
+        for name, renderer_class in get_renderer_classes():
+            if formats and renderer_class.format not in formats:
+                continue
+            view = view_class.as_view(renderer_classes=[renderer_class])
+            times = {}
+            for _ in range(repeat):
+                timings = Timings()
+                timer_stages = run_stages(view, renderer_class, timings)
+                for stage, seconds in list(timings.items()) + list(timer_stages.items()):
+                    times[stage] = min(seconds, times.get(stage, seconds))
+
+            peaks = PeakMemory()
+            if memory:
+                tracemalloc.start()
+                try:
+                    run_stages(view, renderer_class, peaks)
+                finally:
+                    tracemalloc.stop()
+
+            result = {stage: {"time": times[stage], "memory": peaks.get(stage)} for stage in STAGES}
+            for stage in TIMER_STAGES:
+                if stage in times:
+                    result[stage] = {"time": times[stage], "memory": None}
+            results.setdefault(name, {})[str(rows)] = result
+    return results
+
+
+def measure_imports(module="unicef_rest_export.views", repeat=5):
+    """Time and resident memory growth of importing module, once django
+    is set up, keeping the best of repeat fresh interpreters;
+    {"time": seconds, "memory": bytes, "backends": [loaded backends]}
+    """
+    env = dict(os.environ)
+    env.setdefault("DJANGO_SETTINGS_MODULE", "demo.settings")
+    script = IMPORT_SCRIPT.format(paths=list(PATHS), module=module, backends=BACKENDS)
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", script], env=env, check=True, capture_output=True, text=True)
+        result = json.loads(output.stdout)
+        if best is None or result["time"] < best["time"]:
+            best = result
+    return best
+
+
+def compare(baseline, results, threshold, min_time=0.01, min_memory=64 * 1024):
+    """Regressions of results over the baseline, as readable lines.
+    Times under min_time and memory under min_memory are too noisy to compare.
+    """
+    floors = {"time": min_time, "memory": min_memory}
+    regressions = []
+    for format, sizes in results.items():
+        for rows, stages in sizes.items():
+            for stage, current in stages.items():
+                previous = baseline.get(format, {}).get(rows, {}).get(stage)
+                if previous is None:
+                    continue
+                for metric in ("time", "memory"):
+                    before, after = previous.get(metric), current.get(metric)
+                    if not before or after is None:
+                        continue
+                    if max(before, after) < floors[metric]:
+                        continue
+                    if after > before * (1 + threshold):
+                        regressions.append(
+                            "{} {} rows {} {}: {:.4g} -> {:.4g} (+{:.0%})".format(
+                                format, rows, stage, metric, before, after, after / before - 1
+                            )
+                        )
+    return regressions
+
+
+def print_results(results):
+    columns = STAGES + TIMER_STAGES
+    print("{:<12}{:>8}  {}".format("format", "rows", "  ".join("{:>18}".format(stage) for stage in columns)))
+    for format, sizes in results.items():
+        for rows, stages in sizes.items():
+            cells = []
+            for stage in columns:
+                if stage not in stages:
+                    cells.append("{:>18}".format("-"))
+                    continue
+                memory = stages[stage]["memory"]
+                memory = "{:.1f}MB".format(memory / 1024 / 1024) if memory is not None else "-"
+                cells.append("{:>9.3f}s {:>7}".format(stages[stage]["time"], memory))
+            print("{:<12}{:>8}  {}".format(format, rows, "  ".join(cells)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", default="1000,10000,100000", help="comma separated dataset sizes")
+    parser.add_argument("--width", type=int, default=0, help="extra text columns on top of the book fields")
+    parser.add_argument("--formats", default="", help="comma separated renderer formats, all by default")
+    parser.add_argument("--repeat", type=int, default=1, help="runs to keep the best time of")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="baseline json to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed growth, 0.25 is 25%%")
+    parser.add_argument("--min-time", type=float, default=0.01, help="ignore times under this, in seconds")
+    parser.add_argument("--min-memory", type=int, default=64 * 1024, help="ignore memory under this, in bytes")
+    parser.add_argument("--imports", action="store_true", help="measure the import of the views module instead")
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        result = measure_imports(repeat=max(args.repeat, 5))
+        print(
+            "unicef_rest_export.views imported in {:.1f}ms, {:.1f}MB, loading {}".format(
+                result["time"] * 1000, result["memory"] / 1024 / 1024, ", ".join(result["backends"]) or "no backend"
+            )
+        )
+        return 0
+
+    setup_django()
+
+    import django
+    from django.db import connection
+
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, serialize=False)
+    try:
+        results = run_benchmark(
+            [int(rows) for rows in args.rows.split(",")],
+            width=args.width,
+            formats=[format for format in args.formats.split(",") if format],
+            repeat=args.repeat,
+            memory=not args.no_memory,
+        )
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print_results(results)
+    with open(args.output, "w") as fp:
+        json.dump(
+            {
+                "created": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "width": args.width,
+                "results": results,
+            },
+            fp,
+            indent=2,
+        )
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)["results"]
+        regressions = compare(baseline, results, args.threshold, args.min_time, args.min_memory)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,6 +17,8 @@ urlpatterns = [
         views.AuthorTransformView.as_view(),
         name="author-transform",
     ),
+    re_path(r"^author/columns/$", views.AuthorColumnsView.as_view(), name="author-columns"),
+    re_path(r"^author/stream/$", views.AuthorStreamView.as_view(), name="author-stream"),
     re_path(r"^author/invalid/$", views.AuthorInvalidView.as_view(), name="author-invalid"),
     re_path(
         r"^author/template/$",
@@ -24,6 +26,7 @@ urlpatterns = [
         name="author-template",
     ),
     re_path(r"^book/$", views.BookView.as_view(), name="book-view"),
+    re_path(r"^library/$", views.LibraryDatabookView.as_view(), name="library-databook"),
     re_path(r"^book/csv/$", views.BookCSVView.as_view(), name="book-csv-view"),
 ]
 
@@ -2,8 +2,24 @@ from rest_framework.generics import ListAPIView
 from rest_framework.renderers import JSONRenderer
 from rest_framework.viewsets import ModelViewSet
 
-from unicef_rest_export.renderers import FriendlyCSVRenderer
-from unicef_rest_export.views import ExportMixin, ExportModelView, ExportView, ExportViewBase, ExportViewSet
+from unicef_rest_export.renderers import (
+    ExportNDJSONRenderer,
+    ExportStreamingCSVRenderer,
+    ExportStreamingDocxRenderer,
+    ExportStreamingHTMLRenderer,
+    ExportStreamingJSONRenderer,
+    ExportStreamingOpenXMLRenderer,
+    FriendlyCSVRenderer,
+)
+from unicef_rest_export.transforms import batch_transform
+from unicef_rest_export.views import (
+    DatabookExportView,
+    ExportMixin,
+    ExportModelView,
+    ExportView,
+    ExportViewBase,
+    ExportViewSet,
+)
 
 from demo.sample import serializers
 from demo.sample.models import Author, Book
@@ -32,6 +48,36 @@ class AuthorTransformView(ExportView):
         return dataset
 
 
+class AuthorColumnsView(ExportView):
+    queryset = Author.objects.prefetch_related("books")
+    serializer_class = serializers.AuthorSerializer
+    column_transforms = {"Books": "transform_books", "Last name": str.upper}
+    column_renames = {"First name": "Name"}
+    column_drops = ("ID",)
+    column_derives = {"Initials": "get_initials"}
+
+    @batch_transform
+    def transform_books(self, column):
+        return [", ".join(book["name"] for book in books) for books in column]
+
+    def get_initials(self, row):
+        return "{}{}".format(row.get("First name", "")[:1], row.get("Last name", "")[:1])
+
+
+class AuthorStreamView(ExportView):
+    queryset = Author.objects.prefetch_related("books")
+    serializer_class = serializers.AuthorSerializer
+    renderer_classes = (
+        ExportStreamingCSVRenderer,
+        ExportStreamingOpenXMLRenderer,
+        ExportStreamingDocxRenderer,
+        ExportStreamingJSONRenderer,
+        ExportNDJSONRenderer,
+        ExportStreamingHTMLRenderer,
+    )
+    export_chunk_size = 2
+
+
 class AuthorInvalidView(ExportView):
     queryset = Author.objects.all()
     serializer_class = serializers.AuthorInvalidSerializer
@@ -61,6 +107,14 @@ class BookView(ExportView):
     serializer_class = serializers.BookSerializer
 
 
+class LibraryDatabookView(DatabookExportView):
+    export_views = (
+        AuthorView,
+        BookView,
+        (BookView, {"queryset": Book.objects.filter(best_seller=True)}),
+    )
+
+
 class BookCSVView(ExportModelView):
     queryset = Book.objects.all()
     serializer_class = serializers.BookSerializer
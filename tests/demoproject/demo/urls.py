@@ -3,5 +3,6 @@ from django.urls import include, re_path
 
 urlpatterns = [
     re_path(r"^sample/", include("demo.sample.urls")),
+    re_path(r"^export/", include("unicef_rest_export.urls")),
     re_path(r"^admin/", admin.site.urls),
 ]
@@ -0,0 +1,33 @@
+import pytest
+
+from tests.benchmark import compare, measure_imports, run_benchmark, STAGES
+
+
+@pytest.mark.django_db
+def test_run_benchmark():
+    results = run_benchmark([3], width=2, formats=["csv", "xlsx"])
+    assert list(results) == ["csv", "xlsx", "csv-stream", "xlsx-stream"]
+    stages = results["csv"]["3"]
+    assert all(stages[stage]["time"] >= 0 and stages[stage]["memory"] >= 0 for stage in STAGES)
+    # measured through the view, with the stages of its timer
+    assert {"db", "serialize", "render"} <= set(stages)
+    assert "stream" in results["csv-stream"]["3"]
+
+
+def test_compare():
+    baseline = {"csv": {"1000": {"render": {"time": 1.0, "memory": 1000}, "query": {"time": 0.001, "memory": 10}}}}
+    results = {"csv": {"1000": {"render": {"time": 1.2, "memory": 2000}, "query": {"time": 0.005, "memory": 10}}}}
+    assert compare(baseline, results, threshold=0.25, min_memory=0) == [
+        "csv 1000 rows render memory: 1000 -> 2000 (+100%)"
+    ]
+    assert len(compare(baseline, results, threshold=0.1, min_memory=0)) == 2
+    assert len(compare(baseline, results, threshold=0.1)) == 1
+    assert compare(baseline, {"json": results["csv"]}, threshold=0.1) == []
+
+
+def test_measure_imports():
+    result = measure_imports(repeat=1)
+    assert result["time"] > 0
+    # renderer backends are only imported once a format needs them
+    assert result["backends"] == []
+    assert "openpyxl" in measure_imports("unicef_rest_export.renderers, openpyxl", repeat=1)["backends"]
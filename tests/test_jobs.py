@@ -0,0 +1,110 @@
+import os
+import time
+
+from django.urls import reverse
+from tablib import Dataset
+
+import pytest
+
+from tests.factories import AuthorFactory, UserFactory
+from unicef_rest_export import jobs
+
+
+@pytest.fixture(autouse=True)
+def job_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "EXPORT_JOB_ROOT", str(tmp_path))
+
+
+def wait_for(api_client, url):
+    for _ in range(100):
+        response = api_client.get(url)
+        if response.status_code != 202:
+            return response
+        time.sleep(0.05)
+    raise AssertionError("export job did not finish")
+
+
+@pytest.mark.django_db(transaction=True)
+def test_export_async(api_client):
+    author = AuthorFactory()
+    url = "{}?format=csv&async=1".format(reverse("sample:author-view"))
+    response = api_client.get(url)
+    assert response.status_code == 202
+    data = response.json()
+    assert data["status"] == jobs.PENDING
+    assert data["url"].endswith(reverse("unicef_rest_export:job", args=[data["id"]]))
+
+    response = wait_for(api_client, data["url"])
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/csv")
+    dataset = Dataset().load(b"".join(response.streaming_content).decode("utf-8"), "csv")
+    assert dataset["First name"] == [author.first_name]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_export_async_accept(api_client):
+    author = AuthorFactory()
+    url = "{}?async=1".format(reverse("sample:author-view"))
+    data = api_client.get(url, HTTP_ACCEPT="text/csv").json()
+    response = wait_for(api_client, data["url"])
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/csv")
+    dataset = Dataset().load(b"".join(response.streaming_content).decode("utf-8"), "csv")
+    assert dataset["First name"] == [author.first_name]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_export_async_other_user(api_client):
+    api_client.force_authenticate(UserFactory())
+    url = "{}?format=csv&async=1".format(reverse("sample:author-view"))
+    job_url = api_client.get(url).json()["url"]
+    wait_for(api_client, job_url)
+
+    api_client.force_authenticate(UserFactory())
+    assert api_client.get(job_url).status_code == 404
+
+
+def test_export_job_unknown(api_client):
+    response = api_client.get(reverse("unicef_rest_export:job", args=["a" * 32]))
+    assert response.status_code == 404
+    response = api_client.get(reverse("unicef_rest_export:job", args=["abc"]))
+    assert response.status_code == 404
+
+
+def test_file_system_job_store(tmp_path):
+    store = jobs.FileSystemJobStore(str(tmp_path))
+    job_id = store.create(user=None)
+    assert store.get(job_id)["status"] == jobs.PENDING
+    store.save_result(job_id, [b"a", b"b"])
+    store.update(job_id, status=jobs.DONE)
+    assert store.get(job_id)["status"] == jobs.DONE
+    with store.open_result(job_id) as fp:
+        assert fp.read() == b"ab"
+    store.delete(job_id)
+    assert store.get(job_id) is None
+    with pytest.raises(ValueError):
+        store.get_path("../secret", "json")
+
+
+def test_file_system_job_store_expired(tmp_path):
+    store = jobs.FileSystemJobStore(str(tmp_path))
+    old_id = store.create(user=None)
+    store.save_result(old_id, [b"a"])
+    new_id = store.create(user=None)
+    past = time.time() - 3600
+    os.utime(store.get_path(old_id, "json"), (past, past))
+    store.delete_expired(60)
+    assert store.get(old_id) is None
+    assert not os.path.exists(store.get_path(old_id, "result"))
+    assert store.get(new_id) is not None
+
+
+@pytest.mark.django_db
+def test_export_async_deletes_expired(api_client, monkeypatch):
+    monkeypatch.setattr(jobs, "get_executor", lambda: type("Executor", (), {"submit": lambda *args: None})())
+    store = jobs.get_job_store()
+    job_id = store.create(user=None)
+    past = time.time() - jobs.EXPORT_JOB_EXPIRY - 60
+    os.utime(store.get_path(job_id, "json"), (past, past))
+    api_client.get("{}?format=csv&async=1".format(reverse("sample:author-view")))
+    assert store.get(job_id) is None
@@ -0,0 +1,170 @@
+from django.urls import reverse
+from rest_framework import serializers as drf_serializers
+from rest_framework.test import APIRequestFactory
+from tablib import Dataset
+
+import pytest
+
+from unicef_rest_export.metadata import has_static_fields, MetadataRegistry, registry
+from unicef_rest_export.serializers import ExportSerializer
+from unicef_rest_export.views import ExportModelView, ExportView
+
+from demo.sample import serializers
+from demo.sample.models import Book
+from demo.sample.views import BookView
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def empty_registry():
+    registry.clear()
+    yield
+    registry.clear()
+
+
+@pytest.fixture
+def get_fields_calls(monkeypatch):
+    calls = []
+    get_fields = drf_serializers.ModelSerializer.get_fields
+
+    def counted(self):
+        if isinstance(self, serializers.BookSerializer):
+            calls.append(self)
+        return get_fields(self)
+
+    monkeypatch.setattr(drf_serializers.ModelSerializer, "get_fields", counted)
+    return calls
+
+
+def test_metadata_registry(api_client, book, get_fields_calls):
+    url = "{}?format=csv".format(reverse("sample:book-view"))
+    expected = api_client.get(url).content
+    calls = len(get_fields_calls)
+    assert calls
+
+    # the fields of the serializer are not built again
+    assert api_client.get(url).content == expected
+    assert len(get_fields_calls) == calls
+
+
+def test_metadata_registry_fields(api_client, book):
+    url = "{}?format=json".format(reverse("sample:book-view"))
+    assert list(api_client.get(url + "&fields=name,id").json()[0]) == ["Name", "ID"]
+    assert list(api_client.get(url + "&exclude=description").json()[0]) == ["ID", "Name", "Best seller", "Author"]
+    assert list(api_client.get(url).json()[0]) == ["ID", "Name", "Description", "Best seller", "Author"]
+
+
+def test_metadata_registry_fields_bounded(api_client, book, monkeypatch):
+    monkeypatch.setattr(registry, "maxsize", 3)
+    url = "{}?format=json".format(reverse("sample:book-view"))
+    for fields in ["id,name", "name,id", "name,author,id", "author,name", "id,author"]:
+        expected = [{"id": "ID", "name": "Name", "author": "Author"}[name] for name in fields.split(",")]
+        assert list(api_client.get(url + "&fields=" + fields).json()[0]) == expected
+        assert len(registry.entries) <= 3
+
+
+def test_metadata_registry_lru():
+    lru = MetadataRegistry(maxsize=2)
+    assert lru.get("a", lambda: 1) == 1
+    assert lru.get("b", lambda: 2) == 2
+    assert lru.get("a", lambda: 3) == 1
+    assert lru.get("c", lambda: 4) == 4
+    assert list(lru.entries) == ["a", "c"]
+    assert lru.get("b", lambda: 5) == 5
+
+
+def test_metadata_registry_off(api_client, book, get_fields_calls, monkeypatch):
+    monkeypatch.setattr(BookView, "export_metadata_cache", False)
+    url = "{}?format=csv".format(reverse("sample:book-view"))
+    api_client.get(url)
+    calls = len(get_fields_calls)
+    api_client.get(url)
+    assert len(get_fields_calls) == 2 * calls
+
+
+def test_metadata_registry_debug(api_client, book, settings):
+    url = "{}?format=csv".format(reverse("sample:book-view"))
+    api_client.get(url)
+    assert registry.entries
+    settings.DEBUG = True
+    api_client.get(url)
+    entries = dict(registry.entries)
+    api_client.get(url)
+    assert all(registry.entries[key] is not entry for key, entry in entries.items())
+
+
+def test_metadata_registry_setting_changed(api_client, book, settings):
+    api_client.get("{}?format=csv".format(reverse("sample:book-view")))
+    assert registry.entries
+    settings.EXPORT_CHUNK_SIZE = 10
+    assert not registry.entries
+
+
+class BookHideInitSerializer(drf_serializers.ModelSerializer):
+    class Meta:
+        model = Book
+        fields = ("id", "name", "description")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is not None and request.query_params.get("hide"):
+            self.fields.pop("description")
+
+
+class BookHideFieldsSerializer(BookHideInitSerializer):
+    def __init__(self, *args, **kwargs):
+        drf_serializers.ModelSerializer.__init__(self, *args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get("request")
+        if request is not None and request.query_params.get("hide"):
+            fields.pop("description")
+        return fields
+
+
+@pytest.mark.parametrize("serializer_class", [BookHideInitSerializer, BookHideFieldsSerializer])
+@pytest.mark.parametrize("format", ["csv", "json"])
+def test_metadata_registry_request_fields(book, serializer_class, format):
+    view = ExportView.as_view(queryset=Book.objects.all(), serializer_class=serializer_class)
+
+    def get_headers(params):
+        response = view(APIRequestFactory().get("/", dict(params, format=format))).render()
+        return Dataset().load(response.content.decode("utf-8"), format).headers
+
+    assert get_headers({}) == ["ID", "Name", "Description"]
+    assert get_headers({"hide": "1"}) == ["ID", "Name"]
+    assert get_headers({}) == ["ID", "Name", "Description"]
+
+
+def test_has_static_fields():
+    assert has_static_fields(serializers.BookSerializer)
+    assert has_static_fields(BookView().with_list_serializer(serializers.AuthorSerializer))
+    assert not has_static_fields(BookHideInitSerializer)
+    assert not has_static_fields(BookHideFieldsSerializer)
+
+
+def test_with_list_serializer(rf):
+    view = BookView(request=rf.get("/"), format_kwarg=None, kwargs={})
+    cls = view.with_list_serializer(serializers.AuthorSerializer)
+    assert cls.Meta.list_serializer_class is ExportSerializer
+    assert view.with_list_serializer(serializers.AuthorSerializer) is cls
+    assert view.with_list_serializer(serializers.BookSerializer) is serializers.BookSerializer
+
+
+def test_model_view_labels(rf, monkeypatch):
+    class BookModelView(ExportModelView):
+        queryset = Book.objects.all()
+        serializer_class = serializers.BookSerializer
+
+    calls = []
+    get_labels = BookModelView.get_labels
+    monkeypatch.setattr(BookModelView, "get_labels", lambda self, cls: calls.append(cls) or get_labels(self, cls))
+
+    view = BookModelView(request=rf.get("/"), format_kwarg=None, args=(), kwargs={})
+    context = view.get_renderer_context()
+    assert context["labels"]["best_seller"] == "best seller"
+    assert view.get_renderer_context()["labels"] == context["labels"]
+    assert calls == [serializers.BookSerializer]
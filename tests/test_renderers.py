@@ -1,10 +1,30 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from io import BytesIO
+
 from django.urls import reverse
+from docx import Document
+from pypdf import PdfReader
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Paragraph
 from rest_framework.test import APIClient
 from tablib import Dataset
 
 import pytest
 
 from tests.factories import BookFactory, UserFactory
+from unicef_rest_export import renderers
+from unicef_rest_export.budgets import ExportBudget, ExportTooSlow
+from unicef_rest_export.renderers import (
+    ExportDocxRenderer,
+    ExportDocxTableRenderer,
+    ExportExcelRenderer,
+    ExportNDJSONRenderer,
+    ExportPDFRenderer,
+    ExportPDFTableRenderer,
+    PDF_COLUMNS_PER_PAGE,
+)
 
 
 @pytest.mark.xfail
@@ -21,3 +41,149 @@ def test_friendly_renderer():
     assert len(dataset._get_headers()) == 4
     assert dataset[0][2] == ""
     assert dataset[1][2] == "Yes"
+
+
+def test_file_renderer_spool():
+    dataset = Dataset(["a", 1], ["b", 2], headers=["Name", "Number"])
+    renderer = ExportExcelRenderer()
+    content = renderer.render(dataset, renderer_context={})
+    assert isinstance(content, bytes)
+
+    renderer.spool_max_size = 16
+    output = renderer.render(dataset, renderer_context={})
+    assert not isinstance(output, bytes)
+    assert output.read() == content
+    output.close()
+
+
+def test_pdf_table_layout():
+    headers = ["Column {}".format(i) for i in range(20)]
+    dataset = Dataset(*[["value {}".format(i)] * 20 for i in range(5)], headers=headers)
+    renderer = ExportPDFTableRenderer()
+    style = getSampleStyleSheet()["Normal"]
+    layout = renderer.plan_layout([list(row) for row in dataset], headers, style, 636, 456)
+    assert layout[0][0] == 0
+    assert layout[-1][1] == 20
+    for start, end, widths in layout:
+        assert end - start <= PDF_COLUMNS_PER_PAGE
+        assert len(widths) == end - start + 1
+        assert sum(widths) <= 636
+
+
+def test_pdf_table_unbreakable_value():
+    dataset = Dataset([1, "https://example.org/" + "a" * 200], headers=["ID", "Link"])
+    assert ExportPDFTableRenderer().render(dataset, renderer_context={}).startswith(b"%PDF")
+
+
+@pytest.mark.parametrize(
+    "renderer_class", [ExportPDFRenderer, ExportPDFTableRenderer, ExportDocxTableRenderer, ExportDocxRenderer]
+)
+def test_renderer_budget_time(renderer_class, monkeypatch):
+    # checked while the document is built, not only once it is written
+    monkeypatch.setattr(ExportBudget, "check_every", 1)
+    dataset = Dataset(*[[i, "name"] for i in range(3)], headers=["ID", "Name"])
+    renderer = renderer_class()
+    renderer.init_output()
+    renderer.budget = ExportBudget(renderer.format, seconds=1e-9)
+    with pytest.raises(ExportTooSlow):
+        renderer.render_dataset(dataset)
+
+
+@pytest.mark.parametrize("renderer_class", [ExportPDFRenderer, ExportPDFTableRenderer])
+def test_pdf_budget_time_pages(renderer_class, monkeypatch):
+    renderer = renderer_class()
+    monkeypatch.setattr(renderer, "budget", ExportBudget(renderer.format, seconds=1e-9))
+    dataset = Dataset([1, "name"], headers=["ID", "Name"])
+    with pytest.raises(ExportTooSlow):
+        renderer.export_set(dataset._package(), dataset.headers)
+
+
+def test_pdf_table_text_blob(monkeypatch):
+    def export_failure():
+        raise AssertionError("export_failure should not be needed")
+
+    renderer = ExportPDFTableRenderer()
+    monkeypatch.setattr(renderer, "export_failure", export_failure)
+    dataset = Dataset([1, "Name", " ".join(["word"] * 800), False], headers=["ID", "Name", "Description", "Best"])
+    assert renderer.render(dataset, renderer_context={}).startswith(b"%PDF")
+
+
+def test_pdf_table_get_cell():
+    renderer = ExportPDFTableRenderer()
+    style = getSampleStyleSheet()["Normal"]
+    assert renderer.get_cell("plain", 100, style) == "plain"
+    assert renderer.get_cell(12, 100, style) == "12"
+    assert isinstance(renderer.get_cell("<b>bold</b>", 100, style), Paragraph)
+    assert isinstance(renderer.get_cell("two\nlines", 100, style), Paragraph)
+    assert isinstance(renderer.get_cell("too long " * 20, 100, style), Paragraph)
+
+
+def test_docx_table_rows():
+    dataset = Dataset(["a", 1], [" b\tc\nd ", ""], headers=["Name", "Number"])
+    content = ExportDocxTableRenderer().export_set(dataset._package(), dataset.headers)
+
+    table = Document(BytesIO(content)).tables[0]
+    assert [[cell.text for cell in row.cells] for row in table.rows] == [
+        ["Name", "Number"],
+        ["a", "1"],
+        [" b\tc\nd ", ""],
+    ]
+    assert table.rows[1].cells[0].width == table.rows[0].cells[0].width
+
+    # same xml python-docx writes, cell by cell
+    expected = Document().add_table(rows=2, cols=2)
+    expected.rows[1].cells[0].text = " b\tc\nd "
+    expected.rows[1].cells[1].text = ""
+    assert table.rows[2]._tr.xml == expected.rows[1]._tr.xml
+
+
+def get_pdf_pages(content):
+    return [page.extract_text() for page in PdfReader(BytesIO(content)).pages]
+
+
+@pytest.mark.parametrize("renderer_class", [ExportPDFRenderer, ExportPDFTableRenderer])
+def test_pdf_parallel(renderer_class):
+    dataset = Dataset(*[["Name {}".format(i), i] for i in range(5)], headers=["Name", "Number"])
+    renderer = renderer_class()
+    renderer.pdf_workers = 2
+    renderer.pdf_block_size = 2
+    pages = get_pdf_pages(renderer.export_set(dataset._package(), dataset.headers))
+
+    # a page per record, or a table per block of rows
+    assert len(pages) == (5 if renderer_class is ExportPDFRenderer else 3)
+    text = "".join(pages)
+    positions = [text.index("Name {}".format(i)) for i in range(5)]
+    assert positions == sorted(positions)
+    if renderer_class is ExportPDFTableRenderer:
+        # row numbers carry on from block to block
+        assert pages[2].split("\n")[3:] == ["5", "Name 4", "4", ""]
+
+
+def test_pdf_parallel_fallback(monkeypatch):
+    def broken(workers):
+        raise renderers.BrokenExecutor()
+
+    broken.cache_clear = lambda: None
+    monkeypatch.setattr(renderers, "get_pdf_executor", broken)
+    dataset = Dataset(*[["Name {}".format(i), i] for i in range(5)], headers=["Name", "Number"])
+    renderer = ExportPDFTableRenderer()
+    expected = get_pdf_pages(renderer.export_set(dataset._package(), dataset.headers))
+    renderer.pdf_workers = 2
+    renderer.pdf_block_size = 2
+    assert get_pdf_pages(renderer.export_set(dataset._package(), dataset.headers)) == expected
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_json_date_format(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(renderers, "orjson", None)
+    headers = ["day", "at", "amount", "name"]
+    rows = [[date(2020, 1, 2), datetime(2020, 1, 2, 3, 4, 5), Decimal("1.50"), "Zoë"]]
+    renderer = ExportNDJSONRenderer()
+
+    iso = json.loads("".join(renderer.stream_rows(headers, iter(rows), date_format="iso")))
+    assert iso == {"day": "2020-01-02", "at": "2020-01-02T03:04:05", "amount": "1.50", "name": "Zoë"}
+
+    epoch = json.loads("".join(renderer.stream_rows(headers, iter(rows), date_format="epoch")))
+    assert epoch["day"] == 1577923200000
+    assert epoch["at"] == 1577934245000
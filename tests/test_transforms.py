@@ -0,0 +1,145 @@
+import json
+
+from django.urls import reverse
+from tablib import Dataset
+
+import pytest
+
+from tests.factories import AuthorFactory, BookFactory
+from unicef_rest_export.transforms import batch_transform, ColumnPipeline
+from unicef_rest_export.views import ExportMixin
+
+from demo.sample.views import AuthorColumnsView, AuthorStreamView, AuthorTransformView, AuthorView, BookView
+
+pytestmark = pytest.mark.django_db
+
+
+def test_column_pipeline():
+    calls = []
+
+    @batch_transform
+    def double(column):
+        calls.append(column)
+        return [value * 2 for value in column]
+
+    pipeline = ColumnPipeline(
+        ["a", "b", "c"],
+        transforms={"a": str, "b": double, "missing": str},
+        renames={"c": "C", "d": "D"},
+        drops=("a", "e"),
+        derives={"d": lambda row: row["a"] + "!", "e": lambda row: 1 / 0},
+    )
+    assert pipeline.headers == ["b", "C", "D"]
+    assert pipeline.apply([(1, 2, 3), (4, 5, 6)]) == [[4, 3, "1!"], [10, 6, "4!"]]
+    assert calls == [[2, 5]]
+
+
+def test_column_pipeline_noop():
+    pipeline = ColumnPipeline(["a", "b"])
+    assert pipeline.headers == ["a", "b"]
+    assert pipeline.apply([(1, 2)]) == [[1, 2]]
+
+
+def test_export_view_columns(api_client):
+    author = AuthorFactory(first_name="Jane", last_name="Doe")
+    BookFactory(author=author, name="One")
+    BookFactory(author=author, name="Two")
+    response = api_client.get("{}?format=json".format(reverse("sample:author-columns")))
+    assert response.status_code == 200
+    assert response.json() == [{"Books": "One, Two", "Name": "Jane", "Last name": "DOE", "Initials": "JD"}]
+
+    response = api_client.get("{}?format=csv&fields=first_name".format(reverse("sample:author-columns")))
+    assert Dataset().load(response.content.decode("utf-8"), "csv").headers == ["Name", "Initials"]
+
+
+@pytest.mark.parametrize("format", ["csv", "xlsx", "html", "docx"])
+def test_export_view_columns_formats(api_client, format):
+    AuthorFactory.create_batch(2)
+    response = api_client.get("{}?format={}".format(reverse("sample:author-columns"), format))
+    assert response.status_code == 200
+
+
+def test_export_view_columns_stream(api_client, monkeypatch):
+    for name in ("column_transforms", "column_renames", "column_drops", "column_derives", "transform_books"):
+        monkeypatch.setattr(AuthorStreamView, name, getattr(AuthorColumnsView, name), raising=False)
+    monkeypatch.setattr(AuthorStreamView, "get_initials", AuthorColumnsView.get_initials, raising=False)
+    calls = []
+    transform_books = AuthorColumnsView.transform_books
+
+    @batch_transform
+    def counted(self, column):
+        calls.append(len(column))
+        return transform_books(self, column)
+
+    monkeypatch.setattr(AuthorStreamView, "transform_books", counted)
+    for _ in range(5):
+        BookFactory()
+    expected = api_client.get("{}?format=json".format(reverse("sample:author-columns"))).json()
+    response = api_client.get("{}?format=json".format(reverse("sample:author-stream")))
+    assert response.streaming
+    assert json.loads(b"".join(response.streaming_content)) == expected
+    # a call per chunk of export_chunk_size rows
+    assert calls == [2, 2, 1]
+
+
+@pytest.fixture
+def row_transforms(monkeypatch):
+    """Leave out the authors named Skip, and repeat the others
+    (along with their number) as many times as they have books
+    """
+    seen = []
+
+    def transform_row(self, row):
+        seen.append(row)
+        return None if row[2] == "Skip" else row
+
+    def transform_rows(self, rows):
+        index = self.export_headers.index("Books")
+        for number, row in enumerate(ExportMixin.transform_rows(self, rows), 1):
+            for _ in range(len(row[index])):
+                yield [number] + row[1:]
+
+    for view in (AuthorView, AuthorStreamView):
+        monkeypatch.setattr(view, "transform_row", transform_row, raising=False)
+        monkeypatch.setattr(view, "transform_rows", transform_rows, raising=False)
+    return seen
+
+
+@pytest.mark.parametrize("format", ["csv", "json"])
+def test_export_view_transform_rows(api_client, row_transforms, format):
+    BookFactory.create_batch(2, author=AuthorFactory(first_name="Jane"))
+    BookFactory(author=AuthorFactory(first_name="Skip"))
+    BookFactory(author=AuthorFactory(first_name="John"))
+    AuthorFactory(first_name="Nobody")
+
+    for url in (reverse("sample:author-view"), reverse("sample:author-stream")):
+        response = api_client.get("{}?format={}".format(url, format))
+        assert response.status_code == 200
+        content = b"".join(response.streaming_content) if response.streaming else response.content
+        dataset = Dataset().load(content.decode("utf-8"), format)
+        assert [(str(row[0]), row[2]) for row in dataset] == [("1", "Jane"), ("1", "Jane"), ("2", "John")]
+
+
+def test_export_view_transform_rows_lazy(api_client, row_transforms):
+    for _ in range(6):
+        BookFactory()
+    response = api_client.get("{}?format=csv".format(reverse("sample:author-stream")))
+    chunks = iter(response.streaming_content)
+    next(chunks), next(chunks)
+    # rows are transformed as they are rendered, a chunk of 2 serialized at a time
+    assert len(row_transforms) == 1
+    assert len(list(chunks)) == 5
+    assert len(row_transforms) == 6
+
+
+def test_export_view_transform_rows_off():
+    assert not AuthorView().has_row_transforms()
+    assert not AuthorTransformView().has_row_transforms()
+
+
+def test_export_view_transform_row_values(api_client, monkeypatch):
+    BookFactory(name="Keep")
+    BookFactory(name="Drop")
+    monkeypatch.setattr(BookView, "transform_row", lambda self, row: row if row[1] == "Keep" else None, raising=False)
+    response = api_client.get("{}?format=json".format(reverse("sample:book-view")))
+    assert [row["Name"] for row in response.json()] == ["Keep"]
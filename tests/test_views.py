@@ -1,11 +1,40 @@
+import gzip
+import json
+import threading
+from io import BytesIO
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework.test import APIClient
+from docx import Document
+from openpyxl import load_workbook
+from rest_framework import serializers as drf_serializers
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
 from tablib import Dataset
 
 import factory
 import pytest
 
-from tests.factories import BookFactory, UserFactory
+from tests.factories import AuthorFactory, BookFactory, UserFactory
+from unicef_rest_export.budgets import ExportBudget, ExportTooLarge
+from unicef_rest_export.cache import ExportCache
+from unicef_rest_export.renderers import (
+    ExportCSVRenderer,
+    ExportFileRenderer,
+    ExportOpenXMLRenderer,
+    ExportStreamingCSVRenderer,
+    ExportStreamingHTMLRenderer,
+)
+from unicef_rest_export.serializers import ExportSerializer, get_related_lookups
+from unicef_rest_export.signals import export_finished, export_started
+from unicef_rest_export.views import ExportView
+
+from demo.sample import serializers
+from demo.sample.models import Author, Book
+from demo.sample.views import AuthorStreamView, AuthorView, BookView, LibraryDatabookView
 
 pytestmark = pytest.mark.django_db
 
@@ -368,3 +397,644 @@ def test_export_model_view():
     dataset = Dataset().load(response.content.decode("utf-8"), "csv")
     assert len(dataset._get_headers()) == 4
     assert dataset.headers == ["ID", "Books", "First name", "Last name"]
+
+
+def test_export_view_stream_csv_empty(api_client):
+    url = "{}?format=csv".format(reverse("sample:author-stream"))
+    response = api_client.get(url)
+    assert response.status_code == 200
+    assert response.streaming
+    assert b"".join(response.streaming_content) == b""
+
+
+def test_export_view_stream_csv(api_client, django_assert_max_num_queries):
+    for _ in range(5):
+        BookFactory()
+    url = "{}?format=csv".format(reverse("sample:author-view"))
+    expected = api_client.get(url).content
+
+    url = "{}?format=csv".format(reverse("sample:author-stream"))
+    with django_assert_max_num_queries(7):
+        response = api_client.get(url)
+        assert response.status_code == 200
+        assert response.streaming
+        assert response["Content-Type"] == "text/csv; charset=utf-8"
+        assert b"".join(response.streaming_content) == expected
+
+
+def test_export_view_stream_xlsx(api_client):
+    AuthorFactory(first_name="Jane\x01", last_name="Doe")
+    BookFactory(name="Book Title")
+    url = "{}?format=xlsx".format(reverse("sample:author-stream"))
+    response = api_client.get(url)
+    assert response.status_code == 200
+    assert response.streaming
+    workbook = load_workbook(BytesIO(b"".join(response.streaming_content)))
+    rows = list(workbook.active.values)
+    assert rows[0] == ("ID", "Books", "First name", "Last name")
+    assert len(rows) == 3
+    assert rows[1][2:] == ("Jane", "Doe")
+    assert "Book Title" in rows[2][1]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_databook_export(api_client):
+    AuthorFactory(first_name="Jane\x01", last_name="Doe")
+    BookFactory(name="Book Title", best_seller=False)
+    BookFactory(name="Best Seller", best_seller=True)
+    response = api_client.get("{}?format=xlsx".format(reverse("sample:library-databook")))
+    assert response.status_code == 200
+    assert response.streaming
+    assert response["Content-Disposition"] == 'attachment; filename="library-databook.xlsx"'
+    workbook = load_workbook(BytesIO(b"".join(response.streaming_content)))
+    assert workbook.sheetnames == ["Author", "Book", "Book (2)"]
+    authors = list(workbook["Author"].values)
+    assert authors[0] == ("ID", "Books", "First name", "Last name")
+    assert len(authors) == 4
+    assert authors[1][2:] == ("Jane", "Doe")
+    assert [row[1] for row in workbook["Book"].values] == ["Name", "Book Title", "Best Seller"]
+    assert [row[1] for row in workbook["Book (2)"].values] == ["Name", "Best Seller"]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_databook_export_threads(api_client, monkeypatch):
+    AuthorFactory()
+    threads = []
+    get_sheet_rows = LibraryDatabookView.get_sheet_rows
+
+    def recorded(self, view):
+        threads.append(threading.current_thread().name)
+        return get_sheet_rows(self, view)
+
+    monkeypatch.setattr(LibraryDatabookView, "get_sheet_rows", recorded)
+    response = api_client.get("{}?format=xlsx".format(reverse("sample:library-databook")))
+    b"".join(response.streaming_content)
+    assert len(threads) == 3
+    assert all(name.startswith("databook") for name in threads)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_databook_export_error(api_client):
+    AuthorFactory()
+    response = api_client.get("{}?format=xlsx&fields=first_name".format(reverse("sample:library-databook")))
+    assert response.status_code == 400
+    assert not response.streaming
+
+
+def test_databook_export_permissions(api_client, monkeypatch):
+    monkeypatch.setattr(BookView, "permission_classes", [IsAuthenticated])
+    response = api_client.get("{}?format=xlsx".format(reverse("sample:library-databook")))
+    assert response.status_code == 403
+
+
+def test_databook_sheet_title():
+    view = LibraryDatabookView()
+    titles = set()
+    named = type("Named", (), {"get_view_name": lambda self: "Books: [all]/" + "x" * 40})
+    assert view.get_sheet_title(named(), titles) == "Books all" + "x" * 22
+    assert view.get_sheet_title(named(), titles) == "Books all" + "x" * 18 + " (2)"
+
+
+def test_export_view_stream_docx(api_client):
+    AuthorFactory(first_name="Jane\x01", last_name="Doe <&>")
+    BookFactory(name="Book Title")
+    url = "{}?format=docx".format(reverse("sample:author-stream"))
+    response = api_client.get(url)
+    assert response.status_code == 200
+    assert response.streaming
+    content = b"".join(response.streaming_content)
+
+    paragraphs = [p.text for p in Document(BytesIO(content)).paragraphs]
+    assert paragraphs[2:5] == ["First name:Jane", "Last name:Doe <&>", ""]
+    assert len(paragraphs) == 10
+    assert "Book Title" in paragraphs[6]
+
+    url = "{}?format=docx".format(reverse("sample:author-view"))
+    response = api_client.get(url)
+    assert [p.text for p in Document(BytesIO(response.content)).paragraphs] == paragraphs
+
+
+def test_export_view_stream_json(api_client):
+    BookFactory.create_batch(3)
+    expected = json.loads(api_client.get("{}?format=json".format(reverse("sample:author-view"))).content)
+    assert len(expected) == 3
+
+    url = "{}?format=json".format(reverse("sample:author-stream"))
+    response = api_client.get(url)
+    assert response.status_code == 200
+    assert response.streaming
+    assert response["Content-Type"] == "application/json; charset=utf-8"
+    assert json.loads(b"".join(response.streaming_content)) == expected
+
+    url = "{}?format=ndjson".format(reverse("sample:author-stream"))
+    response = api_client.get(url)
+    assert response["Content-Type"] == "application/x-ndjson; charset=utf-8"
+    lines = b"".join(response.streaming_content).decode().splitlines()
+    assert [json.loads(line) for line in lines] == expected
+
+
+def test_export_view_stream_json_empty(api_client):
+    response = api_client.get("{}?format=json".format(reverse("sample:author-stream")))
+    assert b"".join(response.streaming_content) == b"[]"
+    response = api_client.get("{}?format=ndjson".format(reverse("sample:author-stream")))
+    assert b"".join(response.streaming_content) == b""
+
+
+def test_export_view_stream_html(api_client):
+    AuthorFactory(first_name="Jane", last_name="Doe <&>")
+    BookFactory.create_batch(2)
+    url = "{}?format=html".format(reverse("sample:author-stream"))
+    response = api_client.get(url)
+    assert response.status_code == 200
+    assert response.streaming
+    assert response["Content-Type"] == "text/html; charset=utf-8"
+    content = b"".join(response.streaming_content).decode()
+    assert content.startswith("<!DOCTYPE html>")
+    assert content.rstrip().endswith("</html>")
+    assert '<table class="ui-table table-stripe"><thead><tr><th>ID</th>' in content
+    assert content.count("<tr>") == 4
+    assert "<td>Doe &lt;&amp;&gt;</td>" in content
+    assert 'href="{}?format=csv"'.format(reverse("sample:author-stream")) in content
+    assert "export-truncated" not in content
+
+    # the table matches the one of the non streaming renderer, but for its classes
+    expected = api_client.get("{}?format=html".format(reverse("sample:author-view"))).content.decode()
+    table = content.split("<thead>", 1)[1].split("</table>", 1)[0]
+    assert table in expected
+
+
+def test_export_view_stream_html_max_rows(api_client, monkeypatch):
+    monkeypatch.setattr(ExportStreamingHTMLRenderer, "max_rows", 2)
+    AuthorFactory.create_batch(3)
+    url = "{}?format=html".format(reverse("sample:author-stream"))
+    content = b"".join(api_client.get(url).streaming_content).decode()
+    assert content.count("<tr>") == 3
+    stream_url = reverse("sample:author-stream")
+    assert (
+        '<p class="export-truncated">Showing the first 2 rows. Download the full export as '
+        '<a href="{0}?format=csv" rel="external">csv</a>, '
+        '<a href="{0}?format=xlsx" rel="external">xlsx</a>'.format(stream_url)
+    ) in content
+
+    # the links keep the other query parameters and serve the full export
+    content = b"".join(api_client.get(url + "&fields=first_name").streaming_content).decode()
+    assert '<a href="{}?format=csv&amp;fields=first_name" rel="external">csv</a>'.format(stream_url) in content
+    response = api_client.get("{}?format=csv&fields=first_name".format(stream_url))
+    assert len(Dataset().load(b"".join(response.streaming_content).decode(), "csv")) == 3
+
+    # exactly max_rows rows are not truncated
+    Author.objects.first().delete()
+    content = b"".join(api_client.get(url).streaming_content).decode()
+    assert content.count("<tr>") == 3
+    assert "export-truncated" not in content
+
+
+def test_export_view_list_xlsx_spooled(api_client, author, monkeypatch):
+    monkeypatch.setattr(ExportFileRenderer, "spool_max_size", 1024)
+    url = "{}?format=xlsx".format(reverse("sample:author-view"))
+    response = api_client.get(url)
+    assert response.status_code == 200
+    assert response.streaming
+    assert response["Content-Type"].startswith(ExportOpenXMLRenderer.media_type)
+    workbook = load_workbook(BytesIO(b"".join(response.streaming_content)))
+    assert list(workbook.active.values)[1][2] == author.first_name
+
+
+def author_fingerprint(view, queryset):
+    # covers updated rows and their books, which the default cannot
+    return [list(queryset.values_list("pk", "first_name", "last_name").order_by("pk")), Book.objects.count()]
+
+
+def test_export_view_cache(api_client, author, monkeypatch, django_assert_num_queries):
+    monkeypatch.setattr(AuthorView, "export_cache_timeout", 60)
+    monkeypatch.setattr(AuthorView, "get_export_fingerprint", author_fingerprint)
+    url = "{}?format=csv".format(reverse("sample:author-view"))
+    response = api_client.get(url)
+    assert response.status_code == 200
+    etag = response["ETag"]
+    content = response.content
+
+    # fingerprint queries only
+    with django_assert_num_queries(2):
+        response = api_client.get(url)
+    assert response.status_code == 200
+    assert response["ETag"] == etag
+    assert response.content == content
+
+    with django_assert_num_queries(2):
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    AuthorFactory()
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+    assert response.content != content
+
+
+def test_export_view_cache_refreshed(api_client, author, monkeypatch):
+    monkeypatch.setattr(AuthorView, "export_cache_timeout", 60)
+    monkeypatch.setattr(AuthorView, "get_export_fingerprint", author_fingerprint)
+    url = "{}?format=csv".format(reverse("sample:author-view"))
+    etag = api_client.get(url)["ETag"]
+
+    Author.objects.filter(pk=author.pk).update(last_name="Renamed")
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert b"Renamed" in response.content
+
+    BookFactory(author=author, name="New Book")
+    response = api_client.get(url)
+    assert b"New Book" in response.content
+
+    # the etag goes along with the cached entry
+    etag = response["ETag"]
+    cache.clear()
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+
+
+def test_export_view_cache_no_fingerprint(api_client, author, monkeypatch):
+    # without a modified field, updates cannot be told, so nothing is cached
+    monkeypatch.setattr(AuthorView, "export_cache_timeout", 60)
+    url = "{}?format=csv".format(reverse("sample:author-view"))
+    response = api_client.get(url)
+    assert "ETag" not in response
+
+    Author.objects.filter(pk=author.pk).update(last_name="Renamed")
+    response = api_client.get(url, HTTP_IF_NONE_MATCH="*")
+    assert response.status_code == 200
+    assert b"Renamed" in response.content
+
+
+def test_export_cache_size():
+    export_cache = ExportCache(max_entry_size=10, max_size=15)
+    assert not export_cache.set("export:a", "text/csv", b"a" * 11, 60)
+    assert export_cache.set("export:b", "text/csv", b"b" * 10, 60)
+    assert export_cache.set("export:c", "text/csv", b"c" * 5, 60)
+    assert export_cache.get("export:b") is not None
+    assert export_cache.set("export:d", "text/csv", b"d" * 5, 60)
+    assert export_cache.get("export:b") is None
+    assert export_cache.get("export:c") == ("text/csv", b"c" * 5)
+
+
+@pytest.mark.parametrize("export_format", ["csv", "json", "html"])
+def test_export_view_values(api_client, monkeypatch, export_format):
+    BookFactory(best_seller=True)
+    BookFactory(description="")
+    url = "{}?format={}".format(reverse("sample:book-view"), export_format)
+    response = api_client.get(url)
+    assert response.status_code == 200
+
+    monkeypatch.setattr(BookView, "export_values", False)
+    assert api_client.get(url).content == response.content
+
+
+def test_export_view_values_columns(rf):
+    view = BookView(request=rf.get("/"), format_kwarg=None, kwargs={})
+    serializer = serializers.BookSerializer(Book.objects.all(), many=True)
+    columns = view.get_export_values_columns(serializer, Book.objects.all())
+    assert [column for _, column, _ in columns] == ["id", "name", "description", "best_seller", "author_id"]
+
+    serializer = ExportSerializer(Author.objects.all(), child=serializers.AuthorSerializer())
+    assert view.get_export_values_columns(serializer, Author.objects.all()) is None
+
+
+@pytest.mark.parametrize("export_values", [True, False])
+def test_export_view_values_distinct(export_values):
+    for _ in range(2):
+        BookFactory(author=AuthorFactory(first_name="Same"))
+    view = ExportView.as_view(
+        queryset=Author.objects.filter(books__isnull=False).distinct(),
+        serializer_class=serializers.AuthorListSerializer,
+        export_values=export_values,
+    )
+    response = view(APIRequestFactory().get("/", {"format": "csv"})).render()
+    assert response.content.decode() == "First name\r\nSame\r\nSame\r\n"
+
+
+def test_export_view_related_lookups(api_client, django_assert_num_queries):
+    for _ in range(3):
+        BookFactory()
+    url = "{}?format=csv".format(reverse("sample:author-view"))
+    with django_assert_num_queries(2):
+        response = api_client.get(url)
+    assert response.status_code == 200
+
+
+def test_get_related_lookups():
+    class BookAuthorSerializer(drf_serializers.ModelSerializer):
+        author_name = drf_serializers.CharField(source="author.first_name")
+        author_books = drf_serializers.PrimaryKeyRelatedField(source="author.books", many=True, read_only=True)
+
+        class Meta:
+            model = Book
+            fields = ("id", "author", "author_name", "author_books")
+
+    assert get_related_lookups(BookAuthorSerializer(), Book) == (["author"], ["author__books"])
+    assert get_related_lookups(serializers.AuthorSerializer(), Author) == ([], ["books"])
+    assert get_related_lookups(serializers.BookSerializer(), Book) == ([], [])
+
+
+class BookAuthorNameSerializer(drf_serializers.ModelSerializer):
+    author_key = drf_serializers.ReadOnlyField(source="author_id")
+    author_name = drf_serializers.CharField(source="author.first_name")
+
+    class Meta:
+        model = Book
+        fields = ("id", "name", "author_key", "author_name")
+
+
+def test_get_related_lookups_attname():
+    class BookAuthorIDSerializer(drf_serializers.ModelSerializer):
+        author_key = drf_serializers.ReadOnlyField(source="author_id")
+
+        class Meta:
+            model = Book
+            fields = ("id", "author_key")
+
+    assert get_related_lookups(BookAuthorIDSerializer(), Book) == ([], [])
+    assert get_related_lookups(BookAuthorNameSerializer(), Book) == (["author"], [])
+
+
+def test_add_related_lookups_union(rf):
+    view = ExportView(
+        queryset=Book.objects.all(),
+        serializer_class=BookAuthorNameSerializer,
+        request=Request(rf.get("/")),
+        format_kwarg=None,
+        kwargs={},
+    )
+    view.request.accepted_renderer = ExportFileRenderer()
+    queryset = Book.objects.filter(best_seller=True).union(Book.objects.filter(best_seller=False))
+    assert view.add_related_lookups(Book.objects.all()).query.select_related == {"author": {}}
+    assert view.add_related_lookups(queryset) is queryset
+
+
+@pytest.mark.parametrize(
+    "queryset",
+    [
+        Book.objects.all(),
+        Book.objects.only("id", "name"),
+        Book.objects.defer("author"),
+        Book.objects.only("id", "name", "author"),
+    ],
+)
+def test_export_view_related_lookups_deferred(queryset):
+    book = BookFactory()
+    view = ExportView.as_view(queryset=queryset, serializer_class=BookAuthorNameSerializer)
+    response = view(APIRequestFactory().get("/", {"format": "csv"})).render()
+    assert response.status_code == 200
+    dataset = Dataset().load(response.content.decode("utf-8"), "csv")
+    assert dataset["Author name"] == [book.author.first_name]
+    assert dataset["Author key"] == [str(book.author_id)]
+
+
+@pytest.mark.parametrize(
+    "view,ordering",
+    [
+        (AuthorView, ()),
+        (AuthorView, ("-pk",)),
+        (AuthorView, ("-first_name", "pk")),
+        (BookView, ()),
+        (BookView, ("-pk",)),
+        (BookView, ("-name", "pk")),
+    ],
+)
+def test_export_view_chunks(api_client, monkeypatch, view, ordering):
+    for _ in range(5):
+        BookFactory()
+    url = "{}?format=csv".format(reverse("sample:author-view" if view is AuthorView else "sample:book-view"))
+    monkeypatch.setattr(view, "queryset", view.queryset.order_by(*ordering))
+    expected = api_client.get(url).content
+
+    monkeypatch.setattr(view, "export_chunk_size", 2)
+    assert api_client.get(url).content == expected
+    monkeypatch.setattr(view, "export_keyset", True)
+    assert api_client.get(url).content == expected
+
+
+@pytest.mark.parametrize("keyset", [False, True])
+@pytest.mark.parametrize("ordering", [(), ("-pk",), ("name",)])
+def test_export_view_sliced_queryset(api_client, monkeypatch, keyset, ordering):
+    for _ in range(5):
+        BookFactory()
+    queryset = Book.objects.order_by(*ordering)
+    expected = [str(book.pk) for book in queryset[1:4]]
+    monkeypatch.setattr(BookView, "queryset", queryset[1:4])
+    monkeypatch.setattr(BookView, "export_chunk_size", 2)
+    monkeypatch.setattr(BookView, "export_keyset", keyset)
+    response = api_client.get("{}?format=csv".format(reverse("sample:book-view")))
+    assert response.status_code == 200
+    assert Dataset().load(response.content.decode("utf-8"), "csv")["ID"] == expected
+
+
+@pytest.mark.parametrize("keyset", [False, True])
+@pytest.mark.parametrize("renderer_class", [ExportCSVRenderer, ExportStreamingCSVRenderer])
+def test_export_view_union_queryset(keyset, renderer_class):
+    books = [BookFactory(best_seller=i % 2 == 0) for i in range(5)]
+    queryset = Book.objects.filter(best_seller=True).union(Book.objects.filter(best_seller=False))
+    view = ExportView.as_view(
+        queryset=queryset,
+        serializer_class=serializers.BookSerializer,
+        renderer_classes=[renderer_class],
+        export_chunk_size=2,
+        export_keyset=keyset,
+    )
+    response = view(APIRequestFactory().get("/", {"format": "csv"}))
+    assert response.status_code == 200
+    content = b"".join(response.streaming_content) if response.streaming else response.render().content
+    dataset = Dataset().load(content.decode("utf-8"), "csv")
+    assert sorted(int(pk) for pk in dataset["ID"]) == [book.pk for book in books]
+
+
+def test_export_view_union_queryset_fields():
+    book = BookFactory()
+    queryset = Book.objects.filter(pk=book.pk).union(Book.objects.filter(best_seller=True))
+    view = ExportView.as_view(queryset=queryset, serializer_class=serializers.BookSerializer)
+    response = view(APIRequestFactory().get("/", {"format": "csv", "fields": "name,id"})).render()
+    assert response.status_code == 200
+    assert Dataset().load(response.content.decode("utf-8"), "csv").dict == [{"Name": book.name, "ID": str(book.pk)}]
+
+
+def test_export_view_fields(api_client, book):
+    url = "{}?format=csv&fields=last_name,first_name".format(reverse("sample:author-view"))
+    response = api_client.get(url)
+    assert response.status_code == 200
+    dataset = Dataset().load(response.content.decode("utf-8"), "csv")
+    assert dataset.headers == ["Last name", "First name"]
+    assert dataset[0] == (book.author.last_name, book.author.first_name)
+
+
+def test_export_view_fields_exclude(api_client, book, django_assert_num_queries):
+    url = "{}?format=json&exclude=books".format(reverse("sample:author-view"))
+    with django_assert_num_queries(1):
+        response = api_client.get(url)
+    assert response.status_code == 200
+    assert list(response.json()[0].keys()) == ["ID", "First name", "Last name"]
+
+
+def test_export_view_fields_defer(api_client, book, monkeypatch):
+    monkeypatch.setattr(BookView, "export_values", False)
+    url = "{}?format=json&fields=name,id".format(reverse("sample:book-view"))
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.get(url)
+    assert response.status_code == 200
+    assert response.json() == [{"Name": book.name, "ID": book.pk}]
+    assert "description" not in context.captured_queries[0]["sql"]
+
+
+def test_export_view_fields_unknown(api_client, author):
+    url = "{}?format=json&fields=first_name,wrong".format(reverse("sample:author-view"))
+    response = api_client.get(url)
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def export_signals():
+    received = []
+
+    def receiver(signal, **kwargs):
+        received.append((signal, kwargs))
+
+    export_started.connect(receiver)
+    export_finished.connect(receiver)
+    yield received
+    export_started.disconnect(receiver)
+    export_finished.disconnect(receiver)
+
+
+@pytest.mark.parametrize("format", ["csv", "xlsx", "html"])
+def test_export_view_timing(api_client, author, export_signals, format):
+    url = "{}?format={}".format(reverse("sample:author-view"), format)
+    response = api_client.get(url)
+    assert response.status_code == 200
+
+    metrics = dict(metric.split(";", 1) for metric in response["Server-Timing"].split(", "))
+    assert {"db", "serialize", "dataset", "render", "total", "rows", "size"} <= set(metrics)
+    assert metrics["rows"] == 'desc="1"'
+    assert [signal for signal, _ in export_signals] == [export_started, export_finished]
+    timer = export_signals[1][1]["timer"]
+    assert timer.rows == 1
+    assert timer.queries >= 1
+    assert timer.size > 0
+
+
+def test_export_view_timing_stream(api_client, author, export_signals):
+    url = "{}?format=csv".format(reverse("sample:author-stream"))
+    response = api_client.get(url)
+    assert response.status_code == 200
+    assert "serialize;dur=" in response["Server-Timing"]
+    assert [signal for signal, _ in export_signals] == [export_started]
+
+    content = b"".join(response.streaming_content)
+    assert [signal for signal, _ in export_signals] == [export_started, export_finished]
+    timer = export_signals[1][1]["timer"]
+    assert timer.rows == 1
+    assert timer.size == len(content)
+    assert "stream" in timer.stages
+
+
+def test_export_view_timing_off(api_client, author, export_signals, monkeypatch):
+    monkeypatch.setattr(AuthorView, "export_timing", False)
+    url = "{}?format=csv".format(reverse("sample:author-view"))
+    response = api_client.get(url)
+    assert response.status_code == 200
+    assert "Server-Timing" not in response
+    assert export_signals == []
+
+
+def test_export_view_budget_rows(api_client, monkeypatch, django_assert_max_num_queries):
+    AuthorFactory.create_batch(3)
+    monkeypatch.setattr(AuthorView, "export_budgets", {"default": {"rows": 2}, "csv": {}})
+    url = "{}?format=pdf".format(reverse("sample:author-view"))
+    with django_assert_max_num_queries(1):
+        response = api_client.get(url)
+    assert response.status_code == 413
+    assert b"more than 2 rows, the limit for pdf. Use a filter" in response.content
+
+    response = api_client.get("{}?format=csv".format(reverse("sample:author-view")))
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("format", ["csv", "xlsx"])
+def test_export_view_budget_bytes(api_client, author, monkeypatch, format):
+    monkeypatch.setattr(AuthorView, "export_budgets", {format: {"bytes": 10}})
+    response = api_client.get("{}?format={}".format(reverse("sample:author-view"), format))
+    assert response.status_code == 413
+    assert "over 10 bytes, the limit for {}".format(format).encode() in response.content
+
+
+def test_export_view_budget_time(api_client, author, monkeypatch):
+    monkeypatch.setattr(ExportBudget, "check_every", 1)
+    monkeypatch.setattr(AuthorView, "export_budgets", {"csv": {"seconds": 1e-9}})
+    response = api_client.get("{}?format=csv".format(reverse("sample:author-view")))
+    assert response.status_code == 422
+    assert b"took over 1e-09 seconds, the limit for csv" in response.content
+
+
+def test_export_view_budget_stream(api_client, monkeypatch):
+    AuthorFactory.create_batch(3)
+    monkeypatch.setattr(AuthorStreamView, "export_budgets", {"csv": {"bytes": 50}, "xlsx": {"rows": 2}})
+    response = api_client.get("{}?format=csv".format(reverse("sample:author-stream")))
+    assert response.status_code == 200
+    with pytest.raises(ExportTooLarge):
+        b"".join(response.streaming_content)
+
+    response = api_client.get("{}?format=xlsx".format(reverse("sample:author-stream")))
+    assert response.status_code == 413
+    assert b"or a streaming format (csv, docx, json, ndjson, html)" in response.content
+
+
+@pytest.mark.parametrize("format", ["csv", "json", "html"])
+def test_export_view_compress(api_client, author, format):
+    url = "{}?format={}".format(reverse("sample:author-view"), format)
+    expected = api_client.get(url).content
+    response = api_client.get(url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+    assert response.status_code == 200
+    assert response["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response["Vary"]
+    assert gzip.decompress(response.content) == expected
+
+
+def test_export_view_compress_zstd(api_client, author):
+    zstandard = pytest.importorskip("zstandard")
+    url = "{}?format=csv".format(reverse("sample:author-view"))
+    expected = api_client.get(url).content
+    response = api_client.get(url, HTTP_ACCEPT_ENCODING="gzip, zstd")
+    assert response["Content-Encoding"] == "zstd"
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(response.content) == expected
+
+    response = api_client.get(url, HTTP_ACCEPT_ENCODING="gzip, zstd;q=0")
+    assert response["Content-Encoding"] == "gzip"
+
+
+def test_export_view_compress_download(api_client, author):
+    url = "{}?format=csv".format(reverse("sample:author-view"))
+    expected = api_client.get(url).content
+    response = api_client.get(url + "&compress=gz")
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/gzip"
+    assert response["Content-Disposition"] == 'attachment; filename="author.csv.gz"'
+    assert "Content-Encoding" not in response
+    assert gzip.decompress(response.content) == expected
+
+    response = api_client.get(url + "&compress=rar")
+    assert response.status_code == 400
+
+
+def test_export_view_compress_stream(api_client):
+    AuthorFactory.create_batch(5)
+    url = "{}?format=csv".format(reverse("sample:author-stream"))
+    expected = b"".join(api_client.get(url).streaming_content)
+    response = api_client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+    assert response["Content-Encoding"] == "gzip"
+    assert gzip.decompress(b"".join(response.streaming_content)) == expected
+
+
+def test_export_view_compress_binary(api_client, author):
+    url = "{}?format=xlsx&compress=gz".format(reverse("sample:author-view"))
+    response = api_client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response
+    assert response["Content-Type"].startswith(ExportOpenXMLRenderer.media_type)